@@ -1,10 +1,12 @@
 from django.contrib import admin
-from django.http import JsonResponse
+from django.core.exceptions import ImproperlyConfigured
+from django.http import JsonResponse, StreamingHttpResponse, Http404
 from django.template.response import TemplateResponse
 from django.urls import path
 from django.db.models import Count, Q
 from datetime import datetime, timedelta
 
+from . import analytics, exports
 from .models import *
 
 
@@ -17,6 +19,8 @@ class MyAdminSite(admin.AdminSite):
         urls = super().get_urls()
         custom_urls = [
             path('survey-report/', self.admin_view(self.survey_report), name='survey-report'),
+            path('survey-export/', self.admin_view(self.survey_export), name='survey-export'),
+            path('survey-analytics/', self.admin_view(self.survey_analytics), name='survey-analytics'),
             path('stats-user/', self.admin_view(self.stats_user), name='stats-user'),
             path('stats-post/', self.admin_view(self.stats_post), name='stats-post'),
         ]
@@ -137,24 +141,48 @@ class MyAdminSite(admin.AdminSite):
             'stats_post': stats_post
         })
 
+    def survey_analytics(self, request, *args, **kwargs):
+        surveys = SurveyPost.objects.all()
+        survey_ids = [int(pk) for pk in request.GET.getlist('pk') if pk.isdigit()]
+        context = {'surveys': surveys, 'selected': survey_ids}
+        if survey_ids:
+            try:
+                data = analytics.get_analytics(survey_ids)
+            except ImproperlyConfigured as e:
+                context['error'] = str(e)
+                return TemplateResponse(request, 'admin/survey_analytics.html', context)
+
+            options = {option['id']: option['text'] for question in data['questions'] for option in question['options']}
+            context.update({
+                'analytics': data,
+                'option_labels': [options[option_id] for option_id in data['options']],
+                'rows': request.GET.get('rows', ''),
+                'columns': request.GET.get('columns', ''),
+            })
+            if context['rows'].isdigit() and context['columns'].isdigit():
+                table = analytics.crosstab(data, int(context['rows']), int(context['columns']))
+                if table:
+                    table['lines'] = [{'text': option['text'], 'counts': counts, 'total': total} for option, counts, total
+                                      in zip(table['rows']['options'], table['counts'], table['row_totals'])]
+                context['crosstab'] = table
+        return TemplateResponse(request, 'admin/survey_analytics.html', context)
+
+    def survey_export(self, request, *args, **kwargs):
+        survey_post = SurveyPost.objects.filter(id=request.GET.get('pk')).first()
+        export_format = request.GET.get('type', 'csv')
+        if not survey_post or export_format not in exports.FORMATS:
+            raise Http404
+        response = StreamingHttpResponse(exports.iter_export(survey_post, export_format),
+                                         content_type=exports.FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="survey_{survey_post.id}.{export_format}"'
+        return response
+
     def survey_report(self, request, *args, **kwargs):
         surveys = SurveyPost.objects.all()
         survey_id = request.GET.get('pk', None)
         if survey_id:
             survey_post = SurveyPost.objects.get(id=survey_id)
-            questions = SurveyQuestion.objects.filter(survey_post=survey_post)
-
-            report_data = []
-            for question in questions:
-                options = SurveyOption.objects.filter(survey_question=question)
-                options_data = [
-                    {
-                        'text': option.option,
-                        'count': UserSurveyOption.objects.filter(survey_option=option).count()
-                    }
-                    for option in options
-                ]
-                report_data.append({'question': question.question, 'multi_choice': question.multi_choice, 'options': options_data})
+            report_data = survey_post.results()
 
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
                 return JsonResponse({
@@ -249,6 +277,11 @@ class SurveyPostAdmin(admin.ModelAdmin):
     search_fields = ("content", "user__username")
     inlines = [SurveyQuestionInline]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Câu hỏi sửa qua inline làm bản chụp câu hỏi của khảo sát hết hiệu lực
+        SurveyPost.bump_questions_version(pk=form.instance.pk)
+
 
 # Quản lý SurveyQuestion và inline SurveyOption
 class SurveyQuestionAdmin(admin.ModelAdmin):
@@ -257,12 +290,40 @@ class SurveyQuestionAdmin(admin.ModelAdmin):
     search_fields = ("question", "survey_post__content")
     inlines = [SurveyOptionInline]
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Cả khảo sát cũ khi câu hỏi được chuyển sang khảo sát khác
+        SurveyPost.bump_questions_version(pk__in=[form.initial.get('survey_post'), form.instance.survey_post_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        SurveyPost.bump_questions_version(pk=obj.survey_post_id)
+
+    def delete_queryset(self, request, queryset):
+        survey_ids = set(queryset.values_list('survey_post_id', flat=True))
+        super().delete_queryset(request, queryset)
+        SurveyPost.bump_questions_version(pk__in=survey_ids)
+
 
 # Quản lý SurveyOption
 class SurveyOptionAdmin(admin.ModelAdmin):
     list_display = ("option", "survey_question")
     search_fields = ("option", "survey_question__question")
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        SurveyPost.bump_questions_version(
+            questions__in=[form.initial.get('survey_question'), form.instance.survey_question_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        SurveyPost.bump_questions_version(questions=obj.survey_question_id)
+
+    def delete_queryset(self, request, queryset):
+        question_ids = set(queryset.values_list('survey_question_id', flat=True))
+        super().delete_queryset(request, queryset)
+        SurveyPost.bump_questions_version(questions__in=question_ids)
+
 
 # Quản lý Group
 class GroupAdmin(admin.ModelAdmin):
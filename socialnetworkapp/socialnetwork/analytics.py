@@ -0,0 +1,139 @@
+import hashlib
+from itertools import chain
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Count, Max
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Khóa sinh viên lấy từ các ký tự đầu của mã sinh viên (vd. 2151050123 -> "21")
+COHORT_PREFIX_LENGTH = 2
+CACHE_KEY = 'survey:analytics:%s'
+CACHE_TIMEOUT = 60 * 60
+
+
+def require_numpy():
+    if np is None:
+        raise ImproperlyConfigured("Survey analytics requires numpy (pip install numpy).")
+
+
+def cohort_of(student_code):
+    # Người trả lời không phải cựu sinh viên thuộc nhóm ''
+    return (student_code or '')[:COHORT_PREFIX_LENGTH]
+
+
+def survey_versions(survey_ids):
+    # Phiên bản của khảo sát đổi khi khảo sát được sửa hoặc có bài nộp mới
+    from .models import SurveyPost
+
+    return list(SurveyPost.objects.filter(pk__in=survey_ids).order_by('id').annotate(
+        submissions_total=Count('submissions'), last_submitted=Max('submissions__submitted_at')).values_list(
+        'id', 'updated_date', 'submissions_total', 'last_submitted'))
+
+
+def load_options(survey_ids):
+    from .models import SurveyOption
+
+    return list(SurveyOption.objects.filter(survey_question__survey_post_id__in=survey_ids).order_by(
+        'survey_question__survey_post_id', 'survey_question_id', 'id').values(
+        'id', 'option', 'survey_question_id', 'survey_question__question', 'survey_question__multi_choice',
+        'survey_question__survey_post_id'))
+
+
+def load_matrix(survey_ids, option_ids):
+    # Ma trận chỉ báo người trả lời × lựa chọn; hàng theo user_id tăng dần, cột theo thứ tự option_ids
+    from .models import UserSurveyOption
+
+    pairs = UserSurveyOption.objects.filter(survey_option__survey_question__survey_post_id__in=survey_ids).values_list(
+        'user_id', 'survey_option_id')
+    pairs = np.fromiter(chain.from_iterable(pairs.iterator(chunk_size=5000)), dtype=np.int64).reshape(-1, 2)
+    user_ids, rows = np.unique(pairs[:, 0], return_inverse=True)
+    order = np.argsort(option_ids)
+    columns = order[np.searchsorted(option_ids, pairs[:, 1], sorter=order)]
+    matrix = np.zeros((len(user_ids), len(option_ids)), dtype=np.int32)
+    matrix[rows, columns] = 1
+    return user_ids, matrix
+
+
+def load_cohorts(survey_ids, user_ids):
+    from .models import Alumni
+
+    codes = dict(Alumni.objects.filter(user__survey_submissions__survey_post_id__in=survey_ids).values_list(
+        'user_id', 'student_code').distinct())
+    labels, index = np.unique(np.array([cohort_of(codes.get(user_id)) for user_id in user_ids.tolist()], dtype=str),
+                              return_inverse=True)
+    membership = np.zeros((len(user_ids), len(labels)), dtype=np.int32)
+    membership[np.arange(len(user_ids)), index] = 1
+    return labels, membership
+
+
+def compute(survey_ids):
+    require_numpy()
+    options = load_options(survey_ids)
+    option_ids = np.array([option['id'] for option in options], dtype=np.int64)
+    user_ids, matrix = load_matrix(survey_ids, option_ids)
+    labels, membership = load_cohorts(survey_ids, user_ids)
+
+    # Số người chọn đồng thời hai lựa chọn bất kỳ; đường chéo là số lượt chọn của từng lựa chọn
+    co_selection = matrix.T @ matrix
+    cohort_counts = membership.T @ matrix
+
+    questions = {}
+    for option, count in zip(options, np.diag(co_selection).tolist()):
+        question = questions.setdefault(option['survey_question_id'], {
+            'id': option['survey_question_id'],
+            'survey_id': option['survey_question__survey_post_id'],
+            'question': option['survey_question__question'],
+            'multi_choice': option['survey_question__multi_choice'],
+            'options': [],
+        })
+        question['options'].append({'id': option['id'], 'text': option['option'], 'count': count})
+
+    return {
+        'surveys': survey_ids,
+        'respondents': len(user_ids),
+        'questions': list(questions.values()),
+        'options': option_ids.tolist(),
+        'co_selection': co_selection.tolist(),
+        'cohorts': [{'cohort': label, 'respondents': respondents, 'counts': counts}
+                    for label, respondents, counts in zip(labels.tolist(), membership.sum(axis=0).tolist(),
+                                                          cohort_counts.tolist())],
+    }
+
+
+def get_analytics(survey_ids):
+    # Kết quả được cache theo phiên bản của các khảo sát nên tự mất hiệu lực khi có bài nộp mới
+    require_numpy()
+    survey_ids = sorted(set(survey_ids))
+    version = hashlib.md5(repr(survey_versions(survey_ids)).encode()).hexdigest()
+    key = CACHE_KEY % version
+    data = cache.get(key)
+    if data is None:
+        data = compute(survey_ids)
+        cache.set(key, data, CACHE_TIMEOUT)
+    return data
+
+
+def crosstab(analytics, row_question_id, column_question_id):
+    # Bảng chéo của hai câu hỏi là một khối con của ma trận chọn đồng thời
+    require_numpy()
+    questions = {question['id']: question for question in analytics['questions']}
+    if row_question_id not in questions or column_question_id not in questions:
+        return None
+    position = {option_id: i for i, option_id in enumerate(analytics['options'])}
+    rows, columns = questions[row_question_id]['options'], questions[column_question_id]['options']
+    table = np.array(analytics['co_selection'], dtype=np.int32)[
+        np.ix_([position[option['id']] for option in rows], [position[option['id']] for option in columns])]
+    return {
+        'rows': {'id': row_question_id, 'question': questions[row_question_id]['question'],
+                 'options': [{'id': option['id'], 'text': option['text']} for option in rows]},
+        'columns': {'id': column_question_id, 'question': questions[column_question_id]['question'],
+                    'options': [{'id': option['id'], 'text': option['text']} for option in columns]},
+        'counts': table.tolist(),
+        'row_totals': table.sum(axis=1).tolist(),
+        'column_totals': table.sum(axis=0).tolist(),
+    }
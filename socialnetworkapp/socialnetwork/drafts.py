@@ -0,0 +1,259 @@
+import json
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+DRAFT_KEY = 'draft:%s:%s'
+DIRTY_KEY = 'draft:dirty'
+PROCESSING_KEY = 'draft:processing'
+# Số lần bản nháp được sửa trong bộ đệm, để chỉ xóa bản nháp không đổi kể từ khi được đọc ra để ghi
+REVISION_FIELD = '_rev'
+
+
+class MemoryDraftBackend:
+    # Dùng khi chạy thử, kiểm thử hoặc không có Redis (chỉ đúng khi web và Celery chạy chung một tiến trình)
+    def __init__(self, options):
+        self.lock = threading.Lock()
+        self.drafts = {}
+        self.revisions = {}
+        self.dirty = set()
+        self.processing = set()
+
+    def save(self, survey_id, user_id, answers):
+        with self.lock:
+            key = (survey_id, user_id)
+            buffered = self.drafts.setdefault(key, {})
+            if answers:
+                buffered.update(answers)
+                self.revisions[key] = self.revisions.get(key, 0) + 1
+                self.dirty.add(key)
+            return dict(buffered)
+
+    def get(self, survey_id, user_id):
+        with self.lock:
+            return dict(self.drafts.get((survey_id, user_id), {}))
+
+    def discard(self, survey_id, user_id):
+        with self.lock:
+            self.drafts.pop((survey_id, user_id), None)
+            self.revisions.pop((survey_id, user_id), None)
+            self.dirty.discard((survey_id, user_id))
+
+    def claim(self, count):
+        with self.lock:
+            claimed = []
+            while self.dirty and len(claimed) < count:
+                key = self.dirty.pop()
+                self.processing.add(key)
+                claimed.append((*key, dict(self.drafts.get(key, {})), self.revisions.get(key)))
+            return claimed
+
+    def complete(self, claimed):
+        with self.lock:
+            for survey_id, user_id, _, revision in claimed:
+                key = (survey_id, user_id)
+                self.processing.discard(key)
+                if self.revisions.get(key) == revision:
+                    self.drafts.pop(key, None)
+                    self.revisions.pop(key, None)
+
+    def requeue(self, claimed):
+        with self.lock:
+            for survey_id, user_id, _, _ in claimed:
+                self.processing.discard((survey_id, user_id))
+                self.dirty.add((survey_id, user_id))
+
+    def recover(self):
+        with self.lock:
+            self.dirty |= self.processing
+            self.processing.clear()
+
+
+class RedisDraftBackend:
+    # Mỗi bản nháp là một hash question_id -> JSON lựa chọn; tập DIRTY_KEY giữ các bản nháp chưa ghi xuống CSDL,
+    # PROCESSING_KEY giữ các bản nháp đang được ghi cho đến khi transaction commit
+    CLAIM_SCRIPT = """
+        local members = redis.call('spop', KEYS[1], ARGV[1])
+        if #members > 0 then
+            redis.call('sadd', KEYS[2], unpack(members))
+        end
+        return members
+    """
+    COMPLETE_SCRIPT = """
+        if redis.call('hget', KEYS[1], ARGV[1]) == ARGV[2] then
+            redis.call('del', KEYS[1])
+        end
+        redis.call('srem', KEYS[2], ARGV[3])
+    """
+
+    def __init__(self, options):
+        import redis
+
+        self.client = redis.Redis.from_url(options.get('LOCATION', 'redis://localhost:6379/1'))
+        self.timeout = options.get('TIMEOUT', 7 * 24 * 60 * 60)
+        self.claim_script = self.client.register_script(self.CLAIM_SCRIPT)
+        self.complete_script = self.client.register_script(self.COMPLETE_SCRIPT)
+
+    def save(self, survey_id, user_id, answers):
+        key = DRAFT_KEY % (survey_id, user_id)
+        pipe = self.client.pipeline()
+        if answers:
+            pipe.hset(key, mapping={question_id: json.dumps(value) for question_id, value in answers.items()})
+            pipe.hincrby(key, REVISION_FIELD, 1)
+            pipe.sadd(DIRTY_KEY, f"{survey_id}:{user_id}")
+            pipe.expire(key, self.timeout)
+        pipe.hgetall(key)
+        return self.decode(pipe.execute()[-1])
+
+    def get(self, survey_id, user_id):
+        return self.decode(self.client.hgetall(DRAFT_KEY % (survey_id, user_id)))
+
+    def discard(self, survey_id, user_id):
+        pipe = self.client.pipeline()
+        pipe.delete(DRAFT_KEY % (survey_id, user_id))
+        pipe.srem(DIRTY_KEY, f"{survey_id}:{user_id}")
+        pipe.execute()
+
+    def claim(self, count):
+        # Chuyển nguyên tử từ DIRTY_KEY sang PROCESSING_KEY; hash bản nháp được giữ nguyên
+        members = [member.decode().split(':') for member in
+                   self.claim_script(keys=[DIRTY_KEY, PROCESSING_KEY], args=[count])]
+        if not members:
+            return []
+        pipe = self.client.pipeline(transaction=False)
+        for survey_id, user_id in members:
+            pipe.hgetall(DRAFT_KEY % (survey_id, user_id))
+        return [(int(survey_id), int(user_id), self.decode(value), value.get(REVISION_FIELD.encode()))
+                for (survey_id, user_id), value in zip(members, pipe.execute())]
+
+    def complete(self, claimed):
+        # Bản nháp được sửa sau khi đọc ra (phiên bản khác) vẫn nằm trong DIRTY_KEY và được giữ lại
+        pipe = self.client.pipeline(transaction=False)
+        for survey_id, user_id, _, revision in claimed:
+            self.complete_script(keys=[DRAFT_KEY % (survey_id, user_id), PROCESSING_KEY],
+                                 args=[REVISION_FIELD, revision or b'', f"{survey_id}:{user_id}"], client=pipe)
+        pipe.execute()
+
+    def requeue(self, claimed):
+        members = [f"{survey_id}:{user_id}" for survey_id, user_id, _, _ in claimed]
+        pipe = self.client.pipeline()
+        pipe.srem(PROCESSING_KEY, *members)
+        pipe.sadd(DIRTY_KEY, *members)
+        pipe.execute()
+
+    def recover(self):
+        pipe = self.client.pipeline()
+        pipe.sunionstore(DIRTY_KEY, [DIRTY_KEY, PROCESSING_KEY])
+        pipe.delete(PROCESSING_KEY)
+        pipe.execute()
+
+    @staticmethod
+    def decode(value):
+        return {question_id.decode(): json.loads(selected) for question_id, selected in value.items()
+                if question_id != REVISION_FIELD.encode()}
+
+
+_backend = None
+
+
+def get_draft_options():
+    return getattr(settings, 'SURVEY_DRAFTS', {})
+
+
+def get_draft_backend():
+    global _backend
+    if _backend is None:
+        options = get_draft_options()
+        backend_class = import_string(options.get('BACKEND', 'socialnetwork.drafts.MemoryDraftBackend'))
+        _backend = backend_class(options)
+    return _backend
+
+
+def to_answers(selected):
+    # Cùng định dạng SurveyDraft.answers mà ứng dụng di động đọc lại khi tiếp tục khảo sát
+    return [{'question_id': question_id, 'selected_options': value} for question_id, value in selected.items()]
+
+
+def from_answers(answers):
+    return {str(answer['question_id']): answer['selected_options'] for answer in answers or []}
+
+
+def save(survey_id, user_id, answers):
+    return to_answers(get_draft_backend().save(survey_id, user_id, answers))
+
+
+def load(survey_id, user_id, draft=None):
+    # Đọc bản nháp trong CSDL rồi phủ các thay đổi còn nằm trong bộ đệm
+    selected = from_answers(draft.answers if draft else None)
+    selected.update(get_draft_backend().get(survey_id, user_id))
+    return to_answers(selected) if selected else None
+
+
+def discard(survey_id, user_id):
+    get_draft_backend().discard(survey_id, user_id)
+
+
+def write_drafts(pending):
+    from .models import SurveyPost, SurveyDraft, SurveySubmission
+
+    survey_ids = {survey_id for survey_id, _, _ in pending}
+    user_ids = {user_id for _, user_id, _ in pending}
+    now = timezone.now()
+    with transaction.atomic():
+        active = set(SurveyPost.objects.filter(pk__in=survey_ids, active=True).values_list('id', flat=True))
+        # Bỏ bản nháp của khảo sát đã nộp: khảo sát có thể được nộp khi bản nháp còn trong bộ đệm
+        completed = set(SurveySubmission.objects.filter(survey_post_id__in=survey_ids,
+                                                        user_id__in=user_ids).values_list('survey_post_id', 'user_id'))
+        pending = [(survey_id, user_id, answers) for survey_id, user_id, answers in pending
+                   if survey_id in active and (survey_id, user_id) not in completed]
+        if not pending:
+            return 0
+
+        existing = {(draft.survey_post_id, draft.user_id): draft for draft in
+                    SurveyDraft.objects.select_for_update().filter(survey_post_id__in=survey_ids, user_id__in=user_ids)}
+        updated, created = [], []
+        for survey_id, user_id, answers in pending:
+            draft = existing.get((survey_id, user_id))
+            if draft:
+                selected = from_answers(draft.answers)
+                selected.update(answers)
+                draft.answers = to_answers(selected)
+                draft.drafted_at = now
+                updated.append(draft)
+            else:
+                created.append(SurveyDraft(survey_post_id=survey_id, user_id=user_id, answers=to_answers(answers),
+                                           drafted_at=now))
+        SurveyDraft.objects.bulk_update(updated, ['answers', 'drafted_at'])
+        SurveyDraft.objects.bulk_create(created, ignore_conflicts=True)
+    return len(pending)
+
+
+def flush(batch_size=None):
+    backend = get_draft_backend()
+    batch_size = batch_size or get_draft_options().get('BATCH_SIZE', 500)
+    # Bản nháp còn trong tập đang xử lý do worker trước dừng giữa chừng được ghi lại từ đầu
+    backend.recover()
+    total, seen = 0, set()
+    while True:
+        claimed = backend.claim(batch_size)
+        # Bản nháp được sửa tiếp trong lúc flush để lại cho lần chạy sau, tránh lặp mãi khi người dùng vẫn đang nhập
+        again = [entry for entry in claimed if entry[:2] in seen]
+        if again:
+            backend.requeue(again)
+            claimed = [entry for entry in claimed if entry[:2] not in seen]
+        if not claimed:
+            return total
+        seen.update(entry[:2] for entry in claimed)
+        try:
+            with transaction.atomic():
+                total += write_drafts([(survey_id, user_id, answers)
+                                       for survey_id, user_id, answers, _ in claimed if answers])
+                # Chỉ xóa khỏi bộ đệm sau khi ghi xong; lỗi CSDL thì các bản nháp được trả lại hàng đợi
+                transaction.on_commit(partial(backend.complete, claimed))
+        except Exception:
+            backend.requeue(claimed)
+            raise
@@ -0,0 +1,79 @@
+import logging
+import os
+import smtplib
+from string import Template
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Lỗi ở mức kết nối: các thư chưa gửi được gửi lại ở lần thử sau; lỗi khác chỉ làm hỏng thư của người nhận đó
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, smtplib.SMTPAuthenticationError,
+                     ConnectionError, TimeoutError)
+
+
+class BatchInterrupted(Exception):
+    def __init__(self, error, results, remaining):
+        super().__init__(str(error))
+        self.results = results
+        self.remaining = remaining
+
+
+def batch_size():
+    return getattr(settings, 'EMAIL_BATCH_SIZE', 100)
+
+
+def render(template, context):
+    # $name thay cho {name} để nội dung do người dùng nhập (có thể chứa ngoặc nhọn) không làm hỏng template;
+    # thư không có context được gửi nguyên văn
+    return Template(template).safe_substitute(context) if context else template
+
+
+def send_batch(subject, message, recipients):
+    # recipients: [(email, context), ...]; toàn bộ lô dùng chung một phiên SMTP.
+    # Trả về {email: 'sent' | lỗi}; mất kết nối giữa chừng thì ném BatchInterrupted kèm các thư chưa gửi
+    results = {}
+    connection = get_connection()
+    try:
+        connection.open()
+        for i, (email, context) in enumerate(recipients):
+            try:
+                EmailMessage(subject=render(subject, context), body=render(message, context),
+                             from_email=os.getenv('EMAIL_SEND'), to=[email], connection=connection).send()
+                results[email] = 'sent'
+            except CONNECTION_ERRORS as e:
+                raise BatchInterrupted(e, results, recipients[i:])
+            except (smtplib.SMTPException, ValueError) as e:
+                results[email] = str(e)
+    except CONNECTION_ERRORS as e:
+        raise BatchInterrupted(e, results, recipients)
+    finally:
+        connection.close()
+    return results
+
+
+def invitation_message(invitation_post):
+    subject = f"Lời mời tham gia sự kiện: {invitation_post.event_name}"
+    message = f"""Xin chào,
+
+                    Bạn được mời tham gia sự kiện '{invitation_post.event_name}' trên nền tảng của chúng tôi.
+                    Nội dung sự kiện: {invitation_post.content}
+
+                    Trân trọng,
+                    Đội ngũ Admin.
+                """
+    return subject, message
+
+
+def queue_emails(subject, message, recipients):
+    # Chia người nhận thành các lô và gửi sau khi transaction hiện tại commit
+    from .tasks import send_email_batch
+
+    recipients = [[email, context or {}] for email, context in recipients if email]
+    size = batch_size()
+    for start in range(0, len(recipients), size):
+        chunk = recipients[start:start + size]
+        transaction.on_commit(lambda chunk=chunk: send_email_batch.delay(subject, message, chunk))
+    return len(recipients)
@@ -0,0 +1,110 @@
+import csv
+import json
+import os
+import re
+from itertools import groupby, islice
+
+from django.conf import settings
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+CHUNK_SIZE = 2000
+EXPORT_FILE_RE = re.compile(r'^survey_(\d+)_[\w-]+\.(csv|ndjson)$')
+
+
+class Echo:
+    # csv.writer chỉ cần write(); trả lại dòng vừa ghi để stream thẳng ra response
+    def write(self, value):
+        return value
+
+
+def get_export_root():
+    return getattr(settings, 'SURVEY_EXPORT_ROOT', settings.BASE_DIR / 'exports')
+
+
+def export_path(file_name):
+    return os.path.join(get_export_root(), file_name)
+
+
+def export_file_name(survey_id, key, export_format):
+    return f"survey_{survey_id}_{key}.{export_format}"
+
+
+def parse_export_file_name(file_name):
+    # Trả về survey_id nếu tên file hợp lệ (không chứa đường dẫn), ngược lại None
+    match = EXPORT_FILE_RE.match(file_name or '')
+    return int(match.group(1)) if match else None
+
+
+def get_questions(survey_post):
+    from .models import SurveyQuestion
+
+    return list(SurveyQuestion.objects.filter(survey_post=survey_post).order_by('id').values_list('id', 'question'))
+
+
+def iter_responses(survey_post):
+    # Mỗi người trả lời một dòng: (submission, {question_id: [lựa chọn]}).
+    # Duyệt bài nộp theo user_id bằng iterator và nạp câu trả lời cho từng lô CHUNK_SIZE người,
+    # nên bộ nhớ không phụ thuộc số người trả lời
+    from .models import SurveySubmission, UserSurveyOption
+
+    submissions = SurveySubmission.objects.filter(survey_post=survey_post).order_by('user_id').values_list(
+        'user_id', 'user__username', 'submitted_at').iterator(chunk_size=CHUNK_SIZE)
+    while True:
+        batch = list(islice(submissions, CHUNK_SIZE))
+        if not batch:
+            return
+        rows = UserSurveyOption.objects.filter(
+            survey_option__survey_question__survey_post=survey_post,
+            user_id__in=[user_id for user_id, _, _ in batch]).order_by('user_id', 'survey_option_id').values_list(
+            'user_id', 'survey_option__survey_question_id', 'survey_option__option')
+        answers = {}
+        for user_id, options in groupby(rows.iterator(chunk_size=CHUNK_SIZE), key=lambda row: row[0]):
+            selected = answers[user_id] = {}
+            for _, question_id, option in options:
+                selected.setdefault(question_id, []).append(option)
+        for submission in batch:
+            yield submission, answers.get(submission[0], {})
+
+
+def iter_csv(survey_post):
+    questions = get_questions(survey_post)
+    writer = csv.writer(Echo())
+    # BOM để Excel đọc đúng tiếng Việt
+    yield '\ufeff' + writer.writerow(['user_id', 'username', 'submitted_at'] + [text for _, text in questions])
+    for (user_id, username, submitted_at), answers in iter_responses(survey_post):
+        yield writer.writerow([user_id, username, submitted_at.isoformat()] +
+                              ['; '.join(answers.get(question_id, [])) for question_id, _ in questions])
+
+
+def iter_ndjson(survey_post):
+    questions = get_questions(survey_post)
+    for (user_id, username, submitted_at), answers in iter_responses(survey_post):
+        yield json.dumps({
+            'user_id': user_id,
+            'username': username,
+            'submitted_at': submitted_at.isoformat(),
+            'answers': {str(question_id): answers.get(question_id, []) for question_id, _ in questions},
+        }, ensure_ascii=False) + '\n'
+
+
+def iter_export(survey_post, export_format):
+    return iter_csv(survey_post) if export_format == 'csv' else iter_ndjson(survey_post)
+
+
+def write_export(survey_post, export_format, file_name):
+    # Ghi ra file tạm rồi đổi tên để file dở dang không bao giờ được tải về
+    path = export_path(file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + '.part'
+    try:
+        with open(partial, 'w', encoding='utf-8', newline='') as f:
+            for chunk in iter_export(survey_post, export_format):
+                f.write(chunk)
+        os.replace(partial, path)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return path
@@ -0,0 +1,225 @@
+import json
+import logging
+import threading
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+try:
+    from redis import RedisError
+except ImportError:
+    RedisError = ConnectionError
+
+logger = logging.getLogger(__name__)
+
+# Lỗi khi không đọc được kho timeline; nơi gọi quay về truy vấn CSDL thay vì trả về 500
+FEED_ERRORS = (RedisError, ConnectionError)
+
+# Mọi người dùng đang thấy cùng một timeline (chưa lọc theo người theo dõi) nên chỉ có một khóa chung
+TIMELINE_KEY = 'feed:timeline'
+POST_KEY = 'feed:post:%s'
+
+
+class MemoryFeedBackend:
+    # Dùng khi chạy thử, kiểm thử hoặc không có Redis
+    def __init__(self, options):
+        self.lock = threading.Lock()
+        self.timelines = {}
+        self.posts = {}
+
+    def add(self, keys, post_id, max_length):
+        with self.lock:
+            for key in keys:
+                timeline = self.timelines.get(key)
+                if timeline is None:
+                    continue
+                timeline.add(post_id)
+                if len(timeline) > max_length:
+                    timeline.discard(min(timeline))
+
+    def fill(self, key, post_ids, max_length):
+        with self.lock:
+            self.timelines[key] = set(sorted(post_ids, reverse=True)[:max_length])
+
+    def remove(self, keys, post_id):
+        with self.lock:
+            for key in keys:
+                self.timelines.get(key, set()).discard(post_id)
+
+    def exists(self, key):
+        return key in self.timelines
+
+    def range(self, key, before, count):
+        timeline = self.timelines.get(key, set())
+        post_ids = sorted((post_id for post_id in timeline if before is None or post_id < before), reverse=True)
+        return post_ids[:count]
+
+    def get_posts(self, post_ids):
+        return {post_id: self.posts[post_id] for post_id in post_ids if post_id in self.posts}
+
+    def set_posts(self, posts, timeout):
+        self.posts.update(posts)
+
+    def delete_post(self, post_id):
+        self.posts.pop(post_id, None)
+
+    def delete_posts(self, post_ids):
+        with self.lock:
+            for post_id in post_ids:
+                self.posts.pop(post_id, None)
+
+
+class RedisFeedBackend:
+    # Timeline là sorted set (score = id bài viết) để phân trang theo keyset bằng ZREVRANGEBYSCORE
+    def __init__(self, options):
+        import redis
+
+        self.client = redis.Redis.from_url(options.get('LOCATION', 'redis://localhost:6379/1'))
+        self.batch_size = options.get('BATCH_SIZE', 1000)
+
+    def add(self, keys, post_id, max_length):
+        # Chỉ đẩy vào các timeline đã có; timeline chưa có sẽ được nạp từ CSDL khi đọc
+        for batch in self.batches(keys):
+            pipe = self.client.pipeline(transaction=False)
+            for key in batch:
+                pipe.exists(key)
+            existing = [key for key, found in zip(batch, pipe.execute()) if found]
+            pipe = self.client.pipeline(transaction=False)
+            for key in existing:
+                pipe.zadd(key, {post_id: post_id})
+                pipe.zremrangebyrank(key, 0, -max_length - 1)
+            pipe.execute()
+
+    def fill(self, key, post_ids, max_length):
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        if post_ids:
+            pipe.zadd(key, {post_id: post_id for post_id in post_ids})
+            pipe.zremrangebyrank(key, 0, -max_length - 1)
+        pipe.execute()
+
+    def remove(self, keys, post_id):
+        for batch in self.batches(keys):
+            pipe = self.client.pipeline(transaction=False)
+            for key in batch:
+                pipe.zrem(key, post_id)
+            pipe.execute()
+
+    def batches(self, keys):
+        batch = []
+        for key in keys:
+            batch.append(key)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def exists(self, key):
+        return bool(self.client.exists(key))
+
+    def range(self, key, before, count):
+        max_score = '(%d' % before if before is not None else '+inf'
+        return [int(post_id) for post_id in self.client.zrevrangebyscore(key, max_score, '-inf', start=0, num=count)]
+
+    def get_posts(self, post_ids):
+        values = self.client.mget([POST_KEY % post_id for post_id in post_ids]) if post_ids else []
+        return {post_id: json.loads(value) for post_id, value in zip(post_ids, values) if value is not None}
+
+    def set_posts(self, posts, timeout):
+        pipe = self.client.pipeline(transaction=False)
+        for post_id, data in posts.items():
+            pipe.set(POST_KEY % post_id, json.dumps(data), ex=timeout)
+        pipe.execute()
+
+    def delete_post(self, post_id):
+        self.client.delete(POST_KEY % post_id)
+
+    def delete_posts(self, post_ids):
+        for batch in self.batches(POST_KEY % post_id for post_id in post_ids):
+            self.client.delete(*batch)
+
+
+_backend = None
+
+
+def get_feed_options():
+    return getattr(settings, 'FEED', {})
+
+
+def get_feed_backend():
+    global _backend
+    if _backend is None:
+        options = get_feed_options()
+        backend_class = import_string(options.get('BACKEND', 'socialnetwork.feeds.MemoryFeedBackend'))
+        _backend = backend_class(options)
+    return _backend
+
+
+def timeline_key():
+    return TIMELINE_KEY
+
+
+def fan_out_post(post_id):
+    options = get_feed_options()
+    get_feed_backend().add([timeline_key()], post_id, options.get('MAX_LENGTH', 500))
+
+
+def remove_post(post_id):
+    backend = get_feed_backend()
+    backend.delete_post(post_id)
+    backend.remove([timeline_key()], post_id)
+
+
+def invalidate_post(post_id):
+    try:
+        get_feed_backend().delete_post(post_id)
+    except Exception as e:
+        logger.warning(f"Failed to invalidate cached post {post_id}: {str(e)}")
+
+
+def invalidate_author(user_id):
+    # Bài viết trong cache chứa tên và ảnh của tác giả; updated_date đổi để ETag không trả về 304 với dữ liệu cũ
+    from .models import Post
+
+    post_ids = list(Post.objects.filter(user_id=user_id).values_list('id', flat=True))
+    if not post_ids:
+        return
+    Post.objects.filter(pk__in=post_ids).update(updated_date=timezone.now())
+    try:
+        get_feed_backend().delete_posts(post_ids)
+    except Exception as e:
+        logger.warning(f"Failed to invalidate cached posts of user {user_id}: {str(e)}")
+
+
+def warm_timeline():
+    from .models import Post
+
+    max_length = get_feed_options().get('MAX_LENGTH', 500)
+    post_ids = list(Post.objects.filter(active=True).order_by('-id').values_list('id', flat=True)[:max_length])
+    get_feed_backend().fill(timeline_key(), post_ids, max_length)
+
+
+def hydrate_posts(post_ids):
+    from .models import Post
+    from .serializers import PostSerializer
+
+    backend = get_feed_backend()
+    cached = backend.get_posts(post_ids)
+    missing = [post_id for post_id in post_ids if post_id not in cached]
+    if missing:
+        posts = list(PostSerializer().setup_eager_loading(Post.objects.filter(pk__in=missing, active=True)))
+        fresh = {post.id: data for post, data in zip(posts, PostSerializer(posts, many=True).data)}
+        backend.set_posts(fresh, get_feed_options().get('POST_TIMEOUT', 3600))
+        cached.update(fresh)
+    return [cached[post_id] for post_id in post_ids if post_id in cached]
+
+
+def get_timeline_ids(before=None, count=None):
+    backend = get_feed_backend()
+    key = timeline_key()
+    if not backend.exists(key):
+        warm_timeline()
+    count = count or settings.REST_FRAMEWORK.get('PAGE_SIZE', 5)
+    return backend.range(key, before, count)
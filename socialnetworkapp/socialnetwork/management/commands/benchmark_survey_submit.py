@@ -0,0 +1,96 @@
+import queue
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from socialnetwork.models import User, SurveyPost, SurveyQuestion, SurveyOption, UserSurveyOption, SurveySubmission
+
+
+class Command(BaseCommand):
+    help = "Đo thông lượng nộp khảo sát đồng thời trên CSDL đang cấu hình; dữ liệu tạm được xóa sau khi chạy"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--questions', type=int, default=5)
+        parser.add_argument('--options', type=int, default=4)
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--duplicates', type=int, default=10, help="Phần trăm người dùng nộp hai lần cùng lúc")
+
+    def setup(self, options):
+        prefix = f"bench_{uuid.uuid4().hex[:8]}"
+        owner = User.objects.create_user(username=prefix, email=f"{prefix}@example.com", password=None)
+        survey_post = SurveyPost.objects.create(content=prefix, user=owner, end_time=timezone.now() + timedelta(days=1))
+        SurveyQuestion.objects.bulk_create([
+            SurveyQuestion(survey_post=survey_post, question=f"Q{i}", multi_choice=i % 2 == 1)
+            for i in range(options['questions'])])
+        questions = list(SurveyQuestion.objects.filter(survey_post=survey_post).order_by('id'))
+        SurveyOption.objects.bulk_create([SurveyOption(survey_question=question, option=f"O{i}")
+                                          for question in questions for i in range(options['options'])])
+        answers = {}
+        for question in questions:
+            option_ids = list(question.options.order_by('id').values_list('id', flat=True))
+            answers[str(question.id)] = option_ids[:2] if question.multi_choice else option_ids[:1]
+        User.objects.bulk_create([User(username=f"{prefix}_{i}", email=f"{prefix}_{i}@example.com")
+                                  for i in range(options['users'])])
+        users = list(User.objects.filter(username__startswith=f"{prefix}_"))
+        return owner, survey_post, answers, users
+
+    def handle(self, *args, **options):
+        owner, survey_post, answers, users = self.setup(options)
+        jobs = queue.Queue()
+        every = max(1, 100 // options['duplicates']) if options['duplicates'] else 0
+        for i, user in enumerate(users):
+            jobs.put(user)
+            if every and i % every == 0:
+                jobs.put(user)
+        total = jobs.qsize()
+        results = Counter()
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    try:
+                        user = jobs.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        survey_post.submit(user, answers)
+                        outcome = 'accepted'
+                    except ValidationError:
+                        outcome = 'rejected'
+                    except Exception as e:
+                        outcome = f"error: {type(e).__name__}"
+                    with lock:
+                        results[outcome] += 1
+            finally:
+                connection.close()
+
+        try:
+            threads = [threading.Thread(target=worker) for _ in range(options['workers'])]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            self.stdout.write(f"{total} submits ({len(users)} users) with {options['workers']} workers "
+                              f"in {elapsed:.2f}s: {total / elapsed:.0f} submits/s")
+            for outcome, count in sorted(results.items()):
+                self.stdout.write(f"  {outcome}: {count}")
+            submissions = SurveySubmission.objects.filter(survey_post=survey_post).count()
+            rows = UserSurveyOption.objects.filter(survey_option__survey_question__survey_post=survey_post).count()
+            expected = submissions * sum(len(option_ids) for option_ids in answers.values())
+            style = self.style.SUCCESS if submissions == results['accepted'] and rows == expected else self.style.ERROR
+            self.stdout.write(style(f"submissions={submissions} answer rows={rows} (expected {expected})"))
+        finally:
+            survey_post.delete()
+            User.objects.filter(pk__in=[user.pk for user in users] + [owner.pk]).delete()
@@ -0,0 +1,91 @@
+import os
+import time
+import tracemalloc
+
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.core.management.base import BaseCommand
+from django.http.multipartparser import MultiPartParser
+
+from socialnetwork.media import StashUploadHandler, stash, discard
+
+BOUNDARY = 'benchmarkboundary'
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+class MultipartBody:
+    # Sinh body multipart theo từng phần khi được đọc, để bản thân body không chiếm bộ nhớ khi đo
+    def __init__(self, files, file_size):
+        self.parts = []
+        for i in range(files):
+            head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="images"; filename="image_{i}.png"\r\n'
+                    f'Content-Type: image/png\r\n\r\n').encode()
+            self.parts.append((head, file_size))
+        self.tail = f'--{BOUNDARY}--\r\n'.encode()
+        self.length = sum(len(head) + size + 2 for head, size in self.parts) + len(self.tail)
+        self.buffer = b''
+        self.generator = self.generate()
+
+    def generate(self):
+        block = os.urandom(64 * 1024)
+        for head, size in self.parts:
+            yield head + PNG_HEADER
+            remaining = size - len(PNG_HEADER)
+            while remaining > 0:
+                yield block[:min(remaining, len(block))]
+                remaining -= len(block)
+            yield b'\r\n'
+        yield self.tail
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.generator, None)
+            if chunk is None:
+                break
+            self.buffer += chunk
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class Command(BaseCommand):
+    help = "Đo bộ nhớ đỉnh khi phân tích một body multipart lớn với trình xử lý mặc định và StashUploadHandler"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=5)
+        parser.add_argument('--size', type=int, default=50, help="Tổng dung lượng body (MB)")
+
+    def parse(self, handlers, body):
+        meta = {'CONTENT_TYPE': f'multipart/form-data; boundary={BOUNDARY}', 'CONTENT_LENGTH': str(body.length)}
+        return MultiPartParser(meta, body, handlers).parse()[1]
+
+    def measure(self, label, run):
+        tracemalloc.start()
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.stdout.write(f"{label:<10} peak={peak / 1024 / 1024:7.2f} MB  {elapsed:.2f}s")
+
+    def handle(self, *args, **options):
+        file_size = options['size'] * 1024 * 1024 // options['files']
+
+        def default_handlers():
+            # Trước đây: Django đệm file rồi cả file được đọc vào bộ nhớ để đưa cho upload()
+            files = self.parse([MemoryFileUploadHandler(), TemporaryFileUploadHandler()],
+                               MultipartBody(options['files'], file_size))
+            for uploaded_file in files.getlist('images'):
+                uploaded_file.read()
+                uploaded_file.close()
+
+        def stash_handler():
+            files = self.parse([StashUploadHandler()], MultipartBody(options['files'], file_size))
+            for uploaded_file in files.getlist('images'):
+                path, content_hash = stash(uploaded_file)
+                uploaded_file.close()
+                discard(path)
+
+        self.stdout.write(f"{options['files']} files, {options['size']} MB multipart body")
+        self.measure('default', default_handlers)
+        self.measure('streaming', stash_handler)
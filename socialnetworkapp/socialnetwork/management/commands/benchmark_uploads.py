@@ -0,0 +1,50 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from socialnetwork.media import upload_many
+
+
+class FakeMediaBackend:
+    # Giả lập độ trễ mạng của Cloudinary
+    def __init__(self, latency, fail_at=None):
+        self.latency = latency
+        self.fail_at = fail_at
+
+    def upload(self, path, folder):
+        time.sleep(self.latency)
+        if self.fail_at and path.endswith(f"_{self.fail_at}.jpg"):
+            raise IOError(f"Fake upload failed for {path}")
+        return f"https://example.com/{folder}/{os.path.basename(path)}"
+
+
+class Command(BaseCommand):
+    help = "Đo thời gian đăng nhiều ảnh tuần tự và song song với bộ đăng ảnh giả lập"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=10)
+        parser.add_argument('--latency', type=float, default=0.3, help="Độ trễ mỗi lần đăng (giây)")
+        parser.add_argument('--workers', type=int, default=4)
+
+    def handle(self, *args, **options):
+        backend = FakeMediaBackend(options['latency'])
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for i in range(options['images']):
+                path = os.path.join(temp_dir, f"image_{i + 1}.jpg")
+                with open(path, 'wb') as f:
+                    f.write(os.urandom(64 * 1024))
+                paths.append(path)
+
+            for label, workers in (('sequential', 1), ('concurrent', options['workers'])):
+                start = time.perf_counter()
+                upload_many(paths, backend=backend, workers=workers)
+                self.stdout.write(f"{label:<12} workers={workers:<3} {time.perf_counter() - start:.2f}s")
+
+            backend.fail_at = options['images'] // 2 or 1
+            try:
+                upload_many(paths, backend=backend, workers=options['workers'])
+            except IOError as e:
+                self.stdout.write(self.style.SUCCESS(f"Batch failed as a whole: {str(e)}"))
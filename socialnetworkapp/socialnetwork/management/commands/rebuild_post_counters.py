@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from socialnetwork.models import Post, Comment, Reaction, ReactionType
+
+
+def count_subquery(queryset):
+    counts = queryset.filter(post=OuterRef('pk'), active=True).values('post').annotate(total=Count('id')).values('total')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = "Tính lại các bộ đếm bình luận và cảm xúc của bài viết"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--post', type=int, nargs='*', help="Chỉ tính lại cho các bài viết có id này")
+
+    def handle(self, *args, **options):
+        counters = {
+            'comment_count': count_subquery(Comment.objects.all()),
+            'top_level_comment_count': count_subquery(Comment.objects.filter(parent__isnull=True)),
+        }
+        for reaction_type in ReactionType:
+            counters[Reaction.counter_field(reaction_type.value)] = count_subquery(
+                Reaction.objects.filter(reaction=reaction_type.value))
+
+        posts = Post.objects.all()
+        if options['post']:
+            posts = posts.filter(pk__in=options['post'])
+
+        updated = posts.update(**counters)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt counters for {updated} posts."))
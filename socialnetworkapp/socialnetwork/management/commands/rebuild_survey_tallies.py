@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from socialnetwork.models import SurveyOption, SurveyQuestion, UserSurveyOption
+
+
+def tally(subquery):
+    return Coalesce(Subquery(subquery, output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = "Tính lại số lượt chọn của lựa chọn và số người trả lời của câu hỏi khảo sát"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--survey', type=int, nargs='*', help="Chỉ tính lại cho các khảo sát có id này")
+
+    def handle(self, *args, **options):
+        votes = UserSurveyOption.objects.filter(survey_option=OuterRef('pk')).values('survey_option').annotate(
+            total=Count('id')).values('total')
+        respondents = UserSurveyOption.objects.filter(survey_option__survey_question=OuterRef('pk')).values(
+            'survey_option__survey_question').annotate(total=Count('user', distinct=True)).values('total')
+
+        survey_options = SurveyOption.objects.all()
+        questions = SurveyQuestion.objects.all()
+        if options['survey']:
+            survey_options = survey_options.filter(survey_question__survey_post__in=options['survey'])
+            questions = questions.filter(survey_post__in=options['survey'])
+
+        updated_options = survey_options.update(vote_count=tally(votes))
+        updated_questions = questions.update(respondent_count=tally(respondents))
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt tallies for {updated_questions} questions and {updated_options} options."))
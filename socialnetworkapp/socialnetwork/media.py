@@ -0,0 +1,497 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import uuid
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from django.db import transaction
+from django.http.multipartparser import MultiPartParserError
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+MEDIA_FOLDER = 'MangXaHoi'
+CLOUDINARY_PUBLIC_ID_RE = re.compile(r'/upload/(?:v\d+/)?(?P<public_id>.+?)(?:\.\w+)?$')
+CLOUDINARY_UPLOAD_PATH = '/image/upload/'
+# Chiều rộng tối đa của từng kích thước; None là ảnh gốc
+IMAGE_SIZES = {'thumb': 150, 'feed': 720, 'full': None}
+# Bảng kích thước của trường ảnh X nằm ở khóa X_sizes, còn X vẫn là một URL
+SIZES_SUFFIX = '_sizes'
+
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+IMAGE_SIGNATURES = {
+    b'\xff\xd8\xff': 'image/jpeg',
+    b'\x89PNG\r\n\x1a\n': 'image/png',
+    b'GIF87a': 'image/gif',
+    b'GIF89a': 'image/gif',
+}
+
+# url khác None khi nội dung đã được đăng trước đó; ngược lại path là file tạm cần đăng
+Upload = namedtuple('Upload', ['url', 'path', 'content_hash'])
+
+
+class CloudinaryMediaBackend:
+    def __init__(self, options):
+        self.options = options
+
+    def upload(self, path, folder=MEDIA_FOLDER):
+        from cloudinary.uploader import upload
+
+        return upload(path, folder=folder).get('secure_url')
+
+    def delete(self, url):
+        from cloudinary.uploader import destroy
+
+        match = CLOUDINARY_PUBLIC_ID_RE.search(url)
+        if match:
+            destroy(match.group('public_id'))
+
+    def derivative_url(self, url, width):
+        # URL của Cloudinary đã được biến đổi trong derivative_url(); các URL khác được trả về nguyên vẹn
+        return url
+
+
+class LocalMediaBackend:
+    # Lưu ảnh vào MEDIA_ROOT thay cho Cloudinary, dùng khi phát triển và kiểm thử
+    def __init__(self, options):
+        self.root = options.get('LOCATION', settings.MEDIA_ROOT)
+        self.base_url = options.get('BASE_URL', settings.MEDIA_URL)
+
+    def upload(self, path, folder=MEDIA_FOLDER):
+        name = f"{uuid.uuid4().hex}{os.path.splitext(path)[1]}"
+        os.makedirs(os.path.join(self.root, folder), exist_ok=True)
+        destination = os.path.join(self.root, folder, name)
+        shutil.copyfile(path, destination)
+        self.make_derivatives(destination)
+        return f"{self.base_url}{folder}/{name}"
+
+    def make_derivatives(self, path):
+        # Cần Pillow; thiếu Pillow hoặc file không phải ảnh thì mọi kích thước dùng ảnh gốc
+        try:
+            from PIL import Image
+        except ImportError:
+            return
+        try:
+            with Image.open(path) as image:
+                for width in filter(None, image_sizes().values()):
+                    if image.width > width:
+                        resized = image.copy()
+                        resized.thumbnail((width, image.height))
+                        resized.save(self.derivative_path(path, width), format=image.format)
+        except Exception as e:
+            logger.warning(f"Failed to resize {path}: {str(e)}")
+
+    def derivative_path(self, path, width):
+        stem, extension = os.path.splitext(path)
+        return f"{stem}_w{width}{extension}"
+
+    def derivative_url(self, url, width):
+        if not url.startswith(self.base_url):
+            return url
+        path = self.derivative_path(os.path.join(self.root, url[len(self.base_url):]), width)
+        return self.derivative_path(url, width) if os.path.exists(path) else url
+
+    def delete(self, url):
+        if url.startswith(self.base_url):
+            path = os.path.join(self.root, url[len(self.base_url):])
+            discard(path)
+            for width in filter(None, image_sizes().values()):
+                discard(self.derivative_path(path, width))
+
+
+_backend = None
+
+
+def get_media_options():
+    return getattr(settings, 'MEDIA_PIPELINE', {})
+
+
+def get_media_backend():
+    global _backend
+    if _backend is None:
+        options = get_media_options()
+        backend_class = import_string(options.get('BACKEND', 'socialnetwork.media.CloudinaryMediaBackend'))
+        _backend = backend_class(options)
+    return _backend
+
+
+def temp_path(file_name):
+    temp_dir = get_media_options().get('TEMP_DIR', os.path.join(settings.BASE_DIR, 'tmp_uploads'))
+    os.makedirs(temp_dir, exist_ok=True)
+    return os.path.join(temp_dir, f"{uuid.uuid4().hex}{os.path.splitext(file_name or '')[1]}")
+
+
+def max_upload_size():
+    return get_media_options().get('MAX_UPLOAD_SIZE', MAX_UPLOAD_SIZE)
+
+
+def sniff_image_type(head):
+    for signature, content_type in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+class UploadRejected(MultiPartParserError):
+    pass
+
+
+class StashedUploadedFile(UploadedFile):
+    # File đã nằm sẵn trong thư mục tạm của pipeline; bị xóa khi request kết thúc nếu pipeline không nhận
+    def __init__(self, path, name, content_type, size, charset, content_hash):
+        super().__init__(open(path, 'rb'), name, content_type, size, charset)
+        self.path = path
+        self.content_hash = content_hash
+        self.claimed = False
+
+    def temporary_file_path(self):
+        return self.path
+
+    def close(self):
+        try:
+            return self.file.close()
+        finally:
+            if not self.claimed:
+                discard(self.path)
+
+
+class StashUploadHandler(FileUploadHandler):
+    # Ghi từng chunk của multipart thẳng vào thư mục tạm của media pipeline và tính SHA-256 cùng lúc,
+    # nên bộ nhớ không phụ thuộc kích thước hay số lượng ảnh. Loại ảnh được kiểm tra ở chunk đầu tiên,
+    # kích thước được kiểm tra theo từng chunk; vi phạm thì dừng đọc body và trả về 400.
+    chunk_size = 64 * 1024
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.paths = []
+        self.destination = None
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        if content_length and content_length > max_upload_size() * max_images() + self.chunk_size:
+            raise UploadRejected(f"Dung lượng yêu cầu vượt quá giới hạn ({content_length} bytes).")
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if len(self.paths) >= max_images():
+            self.reject(f"Chỉ được đăng tối đa {max_images()} ảnh.")
+        self.path = temp_path(self.file_name)
+        self.paths.append(self.path)
+        self.destination = open(self.path, 'wb')
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start == 0:
+            content_type = sniff_image_type(raw_data[:16])
+            if content_type is None:
+                self.reject(f"{self.file_name} không phải là ảnh hợp lệ.")
+            self.content_type = content_type
+        if start + len(raw_data) > max_upload_size():
+            self.reject(f"{self.file_name} vượt quá {max_upload_size()} bytes.")
+        self.destination.write(raw_data)
+        self.digest.update(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        self.destination.close()
+        self.destination = None
+        if not file_size:
+            self.reject(f"{self.file_name} rỗng.")
+        return StashedUploadedFile(self.path, self.file_name, self.content_type, file_size, self.charset,
+                                   self.digest.hexdigest())
+
+    def upload_interrupted(self):
+        # Chỉ file đang ghi dở bị hủy; các file đã hoàn tất vẫn thuộc về request
+        if self.destination:
+            self.destination.close()
+            self.destination = None
+            discard(self.path)
+
+    def reject(self, message):
+        self.discard_all()
+        raise UploadRejected(message)
+
+    def discard_all(self):
+        if self.destination:
+            self.destination.close()
+            self.destination = None
+        for path in self.paths:
+            discard(path)
+
+
+def stash(uploaded_file):
+    # Ghi file tải lên vào thư mục tạm cho worker Celery, đồng thời tính SHA-256 của nội dung;
+    # file do StashUploadHandler nhận đã nằm sẵn trong thư mục tạm nên không cần ghi lại
+    if isinstance(uploaded_file, StashedUploadedFile):
+        uploaded_file.claimed = True
+        return uploaded_file.path, uploaded_file.content_hash
+
+    path = temp_path(uploaded_file.name)
+    digest = hashlib.sha256()
+    with open(path, 'wb') as destination:
+        for chunk in uploaded_file.chunks():
+            digest.update(chunk)
+            destination.write(chunk)
+    return path, digest.hexdigest()
+
+
+def ingest(uploaded_file):
+    path, content_hash = stash(uploaded_file)
+    url = claim_asset(content_hash)
+    if url:
+        discard(path)
+        return Upload(url, None, content_hash)
+    return Upload(None, path, content_hash)
+
+
+def ingest_many(uploaded_files):
+    uploads = []
+    try:
+        for uploaded_file in uploaded_files:
+            uploads.append(ingest(uploaded_file))
+    except Exception:
+        for upload in uploads:
+            if upload.path:
+                discard(upload.path)
+        raise
+    return uploads
+
+
+def claim_asset(content_hash):
+    # Dùng lại ảnh đã có (kể cả ảnh đang chờ bị dọn) và tăng số tham chiếu
+    from .models import MediaAsset
+
+    assets = MediaAsset.objects.filter(content_hash=content_hash)
+    url = assets.values_list('url', flat=True).first()
+    if url:
+        assets.update(ref_count=F('ref_count') + 1, active=True, deleted_date=None)
+    return url
+
+
+def register_asset(content_hash, url, references=1):
+    # Hai lượt tải cùng nội dung có thể đăng song song; URL của bản ghi đầu tiên được dùng cho cả hai
+    from .models import MediaAsset
+
+    asset, created = MediaAsset.objects.get_or_create(content_hash=content_hash,
+                                                      defaults={'url': url, 'ref_count': references})
+    if not created:
+        MediaAsset.objects.filter(pk=asset.pk).update(ref_count=F('ref_count') + references, active=True,
+                                                      deleted_date=None)
+    return asset.url
+
+
+def release_asset(url):
+    # Ảnh không còn được tham chiếu sẽ bị xóa mềm để delete_permanently_after_30_days dọn sau 30 ngày
+    from .models import MediaAsset
+
+    if not url:
+        return
+    assets = MediaAsset.objects.filter(url=url)
+    if assets.update(ref_count=F('ref_count') - 1):
+        assets.filter(ref_count__lte=0, active=True).update(active=False, deleted_date=timezone.now())
+
+
+def stored_url(value):
+    # CloudinaryField đọc URL đầy đủ từ CSDL thành CloudinaryResource với public_id là phần trước đuôi file;
+    # ảnh đăng qua trang quản trị được lưu dưới dạng public_id thật của Cloudinary
+    from cloudinary import CloudinaryResource
+
+    if isinstance(value, CloudinaryResource):
+        if not value.public_id:
+            return None
+        if '://' not in value.public_id and not value.public_id.startswith('/'):
+            return value.build_url(secure=True)
+        return f"{value.public_id}.{value.format}" if value.format else value.public_id
+    return value or None
+
+
+def image_sizes():
+    return get_media_options().get('IMAGE_SIZES', IMAGE_SIZES)
+
+
+def derivative_url(url, width):
+    if not width:
+        return url
+    if CLOUDINARY_UPLOAD_PATH in url:
+        return url.replace(CLOUDINARY_UPLOAD_PATH, f"{CLOUDINARY_UPLOAD_PATH}c_limit,w_{width},f_auto,q_auto/", 1)
+    return get_media_backend().derivative_url(url, width)
+
+
+def image_size_urls(value):
+    url = stored_url(value)
+    if not url:
+        return None
+    return {name: derivative_url(url, width) for name, width in image_sizes().items()}
+
+
+def image_url(value, size=None):
+    # URL của kích thước được chọn; kích thước không hợp lệ hoặc không chọn thì trả về ảnh gốc
+    url = stored_url(value)
+    if not url:
+        return None
+    return derivative_url(url, image_sizes().get(size))
+
+
+def pick_image_size(data, size):
+    # Gán mọi trường ảnh X trong dữ liệu đã tuần tự hóa bằng URL của kích thước được chọn trong X_sizes
+    if size not in image_sizes():
+        return data
+    if isinstance(data, dict):
+        data = {key: pick_image_size(value, size) for key, value in data.items()}
+        for key, value in list(data.items()):
+            if key.endswith(SIZES_SUFFIX) and isinstance(value, dict):
+                data[key[:-len(SIZES_SUFFIX)]] = value.get(size)
+        return data
+    if isinstance(data, list):
+        return [pick_image_size(item, size) for item in data]
+    return data
+
+
+def upload_many(paths, folder=MEDIA_FOLDER, backend=None, workers=None):
+    # Đăng song song với số luồng giới hạn bởi UPLOAD_WORKERS; một ảnh lỗi thì cả lô lỗi
+    backend = backend or get_media_backend()
+    workers = min(len(paths), workers or get_media_options().get('UPLOAD_WORKERS', 4))
+    if workers <= 1:
+        return [backend.upload(path, folder) for path in paths]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(backend.upload, path, folder) for path in paths]
+        try:
+            return [future.result() for future in futures]
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def upload_batch(paths, content_hashes):
+    # Các ảnh trùng nội dung trong cùng một lô chỉ được đăng một lần
+    unique = dict(zip(content_hashes, paths))
+    uploaded = dict(zip(unique, upload_many(list(unique.values()))))
+    return [uploaded[content_hash] for content_hash in content_hashes]
+
+
+def add_post_images(post, uploaded_files):
+    # Tạo các PostImage bằng một câu lệnh; ảnh đã có được điền URL ngay, còn lại Celery đăng cả lô
+    from .models import PostImage, UploadStatus
+    from .tasks import process_post_images
+
+    if not uploaded_files:
+        return []
+    uploads = ingest_many(uploaded_files)
+    PostImage.objects.bulk_create([
+        PostImage(post=post, image=upload.url, upload_status=UploadStatus.READY.value) if upload.url else
+        PostImage(post=post, upload_status=UploadStatus.PENDING.value)
+        for upload in uploads
+    ])
+
+    pending = [upload for upload in uploads if upload.path]
+    if pending:
+        image_ids = list(PostImage.objects.filter(post=post, upload_status=UploadStatus.PENDING.value)
+                         .order_by('id').values_list('id', flat=True))
+        paths = [upload.path for upload in pending]
+        content_hashes = [upload.content_hash for upload in pending]
+        post_id = post.pk
+        transaction.on_commit(lambda: process_post_images.delay(post_id, image_ids, paths, content_hashes))
+    return uploads
+
+
+def upload_later(instance, field_name, uploaded_file):
+    from .tasks import process_upload
+
+    upload = ingest(uploaded_file)
+    model = type(instance)
+    if upload.url:
+        updates = {field_name: upload.url}
+        if has_upload_status(model):
+            updates['upload_status'] = ready_status(upload.url)
+        model.objects.filter(pk=instance.pk).update(**updates)
+        for name, value in updates.items():
+            setattr(instance, name, value)
+        return upload
+
+    label = model._meta.label
+    pk = instance.pk
+    transaction.on_commit(lambda: process_upload.delay(upload.path, label, pk, field_name, upload.content_hash))
+    return upload
+
+
+def has_upload_status(model):
+    return any(field.name == 'upload_status' for field in model._meta.get_fields())
+
+
+def ready_status(url):
+    from .models import UploadStatus
+
+    return (UploadStatus.READY if url else UploadStatus.FAILED).value
+
+
+def finish_upload(model, pk, field_name, url, content_hash=None):
+    # url là None khi đăng ảnh thất bại
+    from .feeds import invalidate_post, invalidate_author
+    from .models import Post, PostImage, User
+
+    if url and content_hash:
+        url = register_asset(content_hash, url)
+
+    updates = {field_name: url}
+    if has_upload_status(model):
+        updates['upload_status'] = ready_status(url)
+    elif not url:
+        logger.warning(f"Failed to upload {field_name} for {model._meta.label} {pk}")
+        return
+    if not model.objects.filter(pk=pk).update(**updates):
+        release_asset(url)
+        return
+
+    if model is PostImage:
+        post_id = PostImage.objects.filter(pk=pk).values_list('post_id', flat=True).first()
+        if post_id:
+            Post.objects.filter(pk=post_id).update(updated_date=timezone.now())
+            invalidate_post(post_id)
+    elif model is User:
+        invalidate_author(pk)
+
+
+def finish_post_images(post_id, image_ids, urls, content_hashes=None):
+    # urls là None khi cả lô thất bại; ảnh đã bị xóa bởi lần cập nhật sau sẽ không bị ghi lại
+    from .feeds import invalidate_post
+    from .models import Post, PostImage, UploadStatus
+
+    if urls is None:
+        PostImage.objects.filter(pk__in=image_ids).update(upload_status=UploadStatus.FAILED.value)
+    else:
+        existing = set(PostImage.objects.filter(pk__in=image_ids).values_list('pk', flat=True))
+        if content_hashes:
+            references = Counter(content_hash for pk, content_hash in zip(image_ids, content_hashes)
+                                 if pk in existing)
+            asset_urls = {}
+            for url, content_hash in zip(urls, content_hashes):
+                if content_hash in references and content_hash not in asset_urls:
+                    asset_urls[content_hash] = register_asset(content_hash, url, references[content_hash])
+            urls = [asset_urls.get(content_hash, url) for url, content_hash in zip(urls, content_hashes)]
+        PostImage.objects.bulk_update([PostImage(pk=pk, image=url, upload_status=UploadStatus.READY.value)
+                                       for pk, url in zip(image_ids, urls) if pk in existing],
+                                      ['image', 'upload_status'])
+    Post.objects.filter(pk=post_id).update(updated_date=timezone.now())
+    invalidate_post(post_id)
+
+
+def max_images():
+    return get_media_options().get('MAX_IMAGES', 10)
+
+
+def discard(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
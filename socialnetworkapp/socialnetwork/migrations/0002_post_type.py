@@ -0,0 +1,25 @@
+# Generated by Django 5.1.2 on 2026-10-17 23:34
+
+from django.db import migrations, models
+
+
+def fill_post_type(apps, schema_editor):
+    Post = apps.get_model('socialnetwork', 'Post')
+    Post.objects.filter(surveypost__isnull=False).update(post_type=2)
+    Post.objects.filter(invitationpost__isnull=False).update(post_type=3)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='post_type',
+            field=models.IntegerField(choices=[(1, 'Post'), (2, 'Survey'), (3, 'Invitation')], default=1, editable=False),
+        ),
+        migrations.RunPython(fill_post_type, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-17 23:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0002_post_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['active', '-created_date', '-id'], name='post_feed_idx'),
+        ),
+    ]
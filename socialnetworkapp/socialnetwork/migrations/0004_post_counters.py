@@ -0,0 +1,60 @@
+# Generated by Django 5.1.2 on 2026-10-17 23:36
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_post_counters(apps, schema_editor):
+    Post = apps.get_model('socialnetwork', 'Post')
+    Comment = apps.get_model('socialnetwork', 'Comment')
+    Reaction = apps.get_model('socialnetwork', 'Reaction')
+
+    def count(queryset):
+        counts = queryset.filter(post=OuterRef('pk'), active=True).values('post').annotate(
+            total=Count('id')).values('total')
+        return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+    Post.objects.update(
+        comment_count=count(Comment.objects.all()),
+        top_level_comment_count=count(Comment.objects.filter(parent__isnull=True)),
+        like_count=count(Reaction.objects.filter(reaction=1)),
+        haha_count=count(Reaction.objects.filter(reaction=2)),
+        love_count=count(Reaction.objects.filter(reaction=3)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0003_post_feed_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comment_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='haha_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='love_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='top_level_comment_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_post_counters, migrations.RunPython.noop),
+    ]
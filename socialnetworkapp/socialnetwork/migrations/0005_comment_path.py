@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-17 23:38
+
+from django.db import migrations, models
+
+
+def fill_comment_path(apps, schema_editor):
+    Comment = apps.get_model('socialnetwork', 'Comment')
+    paths = {}
+    comments = []
+    for comment in Comment.objects.order_by('id').only('id', 'parent_id', 'path', 'depth').iterator(chunk_size=2000):
+        if comment.parent_id in paths:
+            parent_path, parent_depth = paths[comment.parent_id]
+            comment.path = f"{parent_path}{comment.parent_id:010d}/"
+            comment.depth = parent_depth + 1
+        paths[comment.id] = (comment.path, comment.depth)
+        comments.append(comment)
+    Comment.objects.bulk_update(comments, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0004_post_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'active', 'path'], name='comment_thread_idx'),
+        ),
+        migrations.RunPython(fill_comment_path, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.2 on 2026-10-17 23:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from socialnetwork.search import tokenize
+
+
+def add_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE socialnetwork_searchdocument ADD FULLTEXT INDEX searchdocument_content_ft (content)')
+
+
+def remove_fulltext_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE socialnetwork_searchdocument DROP INDEX searchdocument_content_ft')
+
+
+def fill_search_documents(apps, schema_editor):
+    Post = apps.get_model('socialnetwork', 'Post')
+    InvitationPost = apps.get_model('socialnetwork', 'InvitationPost')
+    Comment = apps.get_model('socialnetwork', 'Comment')
+    SearchDocument = apps.get_model('socialnetwork', 'SearchDocument')
+
+    event_names = dict(InvitationPost.objects.values_list('pk', 'event_name'))
+    documents = [
+        SearchDocument(post_id=post_id, content=' '.join(tokenize(f"{content} {event_names.get(post_id, '')}")))
+        for post_id, content in Post.objects.filter(active=True).values_list('pk', 'content').iterator()
+    ]
+    documents += [
+        SearchDocument(post_id=post_id, comment_id=comment_id, content=' '.join(tokenize(content)))
+        for comment_id, post_id, content in
+        Comment.objects.filter(active=True).values_list('pk', 'post_id', 'content').iterator()
+    ]
+    SearchDocument.objects.bulk_create(documents, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0005_comment_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content', models.TextField()),
+                ('comment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='socialnetwork.comment')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='socialnetwork.post')),
+            ],
+            options={
+                'unique_together': {('post', 'comment')},
+            },
+        ),
+        migrations.RunPython(add_fulltext_index, remove_fulltext_index),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-17 23:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0006_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='upload_status',
+            field=models.IntegerField(choices=[(0, 'Ready'), (1, 'Pending'), (2, 'Failed')], default=0),
+        ),
+        migrations.AddField(
+            model_name='postimage',
+            name='upload_status',
+            field=models.IntegerField(choices=[(0, 'Ready'), (1, 'Pending'), (2, 'Failed')], default=0),
+        ),
+    ]
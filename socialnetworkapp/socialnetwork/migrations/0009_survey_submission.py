@@ -0,0 +1,37 @@
+# Generated by Django 5.1.2 on 2026-10-17 23:56
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_survey_submissions(apps, schema_editor):
+    UserSurveyOption = apps.get_model('socialnetwork', 'UserSurveyOption')
+    SurveySubmission = apps.get_model('socialnetwork', 'SurveySubmission')
+    pairs = (UserSurveyOption.objects.values_list('survey_option__survey_question__survey_post_id', 'user_id')
+             .distinct().order_by())
+    SurveySubmission.objects.bulk_create([SurveySubmission(survey_post_id=survey_post_id, user_id=user_id)
+                                          for survey_post_id, user_id in pairs], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0008_media_asset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveySubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('submitted_at', models.DateTimeField(auto_now_add=True)),
+                ('survey_post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='submissions', to='socialnetwork.surveypost')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='survey_submissions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('survey_post', 'user')},
+            },
+        ),
+        migrations.RunPython(fill_survey_submissions, migrations.RunPython.noop),
+    ]
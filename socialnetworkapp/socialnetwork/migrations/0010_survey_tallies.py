@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-17 23:57
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_survey_tallies(apps, schema_editor):
+    SurveyOption = apps.get_model('socialnetwork', 'SurveyOption')
+    SurveyQuestion = apps.get_model('socialnetwork', 'SurveyQuestion')
+    UserSurveyOption = apps.get_model('socialnetwork', 'UserSurveyOption')
+
+    votes = UserSurveyOption.objects.filter(survey_option=OuterRef('pk')).values('survey_option').annotate(
+        total=Count('id')).values('total')
+    respondents = UserSurveyOption.objects.filter(survey_option__survey_question=OuterRef('pk')).values(
+        'survey_option__survey_question').annotate(total=Count('user', distinct=True)).values('total')
+    SurveyOption.objects.update(vote_count=Coalesce(Subquery(votes, output_field=IntegerField()), Value(0)))
+    SurveyQuestion.objects.update(respondent_count=Coalesce(Subquery(respondents, output_field=IntegerField()),
+                                                            Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0009_survey_submission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveyoption',
+            name='vote_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='surveyquestion',
+            name='respondent_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_survey_tallies, migrations.RunPython.noop),
+    ]
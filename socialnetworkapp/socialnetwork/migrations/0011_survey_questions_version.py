@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0010_survey_tallies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveypost',
+            name='questions_version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
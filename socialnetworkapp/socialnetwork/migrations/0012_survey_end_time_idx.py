@@ -0,0 +1,17 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socialnetwork', '0011_survey_questions_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='surveypost',
+            index=models.Index(fields=['end_time'], name='survey_end_time_idx'),
+        ),
+    ]
@@ -1,10 +1,13 @@
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Q
 from cloudinary.models import CloudinaryField
 from enum import IntEnum
 from django.utils import timezone
 
+from . import drafts, search, snapshots
+
 
 class BaseModel(models.Model):
     created_date = models.DateTimeField(auto_now_add=True, null=True)
@@ -49,9 +52,31 @@ class User(AbstractUser):
         default=Role.ADMIN.value
     )
 
+    # Thông tin tác giả được lưu kèm bài viết trong cache của timeline
+    PROFILE_FIELDS = ('username', 'first_name', 'last_name', 'email', 'role', 'avatar', 'cover')
+
     class Meta:
         ordering = ['id']
 
+    def profile(self):
+        return tuple(str(getattr(self, field)) for field in self.PROFILE_FIELDS)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields():
+            instance._loaded_profile = instance.profile()
+        return instance
+
+    def save(self, *args, **kwargs):
+        from .feeds import invalidate_author
+
+        super().save(*args, **kwargs)
+        profile = self.profile()
+        if getattr(self, '_loaded_profile', profile) != profile:
+            invalidate_author(self.pk)
+        self._loaded_profile = profile
+
 class Alumni(BaseModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     student_code = models.CharField(max_length=10, unique=True)
@@ -95,21 +120,109 @@ class Teacher(BaseModel):
         super().delete(*args, **kwargs)
 
 
+class PostType(IntEnum):
+    POST = 1
+    SURVEY = 2
+    INVITATION = 3
+
+    @classmethod
+    def choices(cls):
+        return [(post_type.value, post_type.name.capitalize()) for post_type in cls]
+
+
 class Post(BaseModel):
+    POST_TYPE = PostType.POST
+    COUNTER_FIELDS = ['comment_count', 'top_level_comment_count', 'like_count', 'haha_count', 'love_count']
+
     content = models.TextField()
     lock_comment = models.BooleanField(default=False)
+    post_type = models.IntegerField(choices=PostType.choices(), default=PostType.POST.value, editable=False)
+    comment_count = models.IntegerField(default=0, editable=False)
+    top_level_comment_count = models.IntegerField(default=0, editable=False)
+    like_count = models.IntegerField(default=0, editable=False)
+    haha_count = models.IntegerField(default=0, editable=False)
+    love_count = models.IntegerField(default=0, editable=False)
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=False)
 
+    class Meta(BaseModel.Meta):
+        indexes = [
+            models.Index(fields=['active', '-created_date', '-id'], name='post_feed_idx'),
+        ]
+
     def __str__(self):
         return self.content
 
+    def save(self, *args, **kwargs):
+        from .feeds import invalidate_post
+        from .tasks import push_post_to_feeds
+
+        adding = self._state.adding
+        if adding:
+            self.post_type = self.POST_TYPE.value
+        elif not args and kwargs.get('update_fields') is None:
+            # Các bộ đếm chỉ được cập nhật bằng F(), không ghi đè bằng giá trị cũ trong bộ nhớ
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.COUNTER_FIELDS]
+        elif kwargs.get('update_fields') is not None:
+            # updated_date là phiên bản dùng cho ETag/Last-Modified nên luôn được cập nhật
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'updated_date'}
+        super().save(*args, **kwargs)
+
+        if adding:
+            transaction.on_commit(lambda: push_post_to_feeds.delay(self.pk))
+        else:
+            invalidate_post(self.pk)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'content', 'event_name', 'active'} & set(update_fields):
+            search.index_post(self)
+
+    def soft_delete(self, using=None, keep_parents=False):
+        from .tasks import remove_post_from_feeds
+
+        super().soft_delete(using, keep_parents)
+        transaction.on_commit(lambda: remove_post_from_feeds.delay(self.pk))
+
+    def restore(self, using=None, keep_parents=False):
+        from .tasks import push_post_to_feeds
+
+        super().restore(using, keep_parents)
+        transaction.on_commit(lambda: push_post_to_feeds.delay(self.pk))
+
+    @property
+    def object_type(self):
+        return PostType(self.post_type).name.lower()
+
     def can_user_comment(self):
         return not self.lock_comment
 
 
+class MediaAsset(BaseModel):
+    # Ảnh đã đăng lên kho lưu trữ, định danh bằng SHA-256 của nội dung để dùng lại khi tải lên trùng.
+    # ref_count về 0 thì bản ghi bị xóa mềm và được tác vụ dọn dẹp 30 ngày xóa hẳn cùng với file.
+    content_hash = models.CharField(max_length=64, unique=True)
+    url = models.CharField(max_length=255, db_index=True)
+    ref_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.url
+
+
+class UploadStatus(IntEnum):
+    READY = 0
+    PENDING = 1
+    FAILED = 2
+
+    @classmethod
+    def choices(cls):
+        return [(upload_status.value, upload_status.name.capitalize()) for upload_status in cls]
+
+
 class PostImage(models.Model):
     image = CloudinaryField('Post Image', null=True, blank=True, folder='MangXaHoi')
+    # Ảnh được đăng lên kho lưu trữ bởi Celery; image rỗng cho tới khi upload_status là READY
+    upload_status = models.IntegerField(choices=UploadStatus.choices(), default=UploadStatus.READY.value)
 
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='images')
 
@@ -126,17 +239,161 @@ class SurveyType(IntEnum):
 
 
 class SurveyPost(Post):
+    POST_TYPE = PostType.SURVEY
+    COUNTER_FIELDS = Post.COUNTER_FIELDS + ['questions_version']
+
     end_time = models.DateTimeField()
     survey_type = models.IntegerField(choices=SurveyType.choices(),
                                       default=SurveyType.TRAINING_PROGRAM.value)
+    # Tăng mỗi khi câu hỏi hoặc lựa chọn thay đổi; là một phần khóa của bản chụp câu hỏi (snapshots)
+    questions_version = models.PositiveIntegerField(default=1, editable=False)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['end_time'], name='survey_end_time_idx'),
+        ]
 
     def __str__(self):
         return f"{self.content} - {SurveyType(self.survey_type).name.capitalize()}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_end_time = instance.__dict__.get('end_time')
+        return instance
+
+    def save(self, *args, **kwargs):
+        from .tasks import close_survey
+
+        self.end_time = self._meta.get_field('end_time').to_python(self.end_time)
+        reschedule = self._state.adding or self.end_time != getattr(self, '_loaded_end_time', None)
+        update_fields = kwargs.get('update_fields')
+        super().save(*args, **kwargs)
+
+        if reschedule or update_fields is None or 'active' in update_fields:
+            # end_time được cache cho khảo sát đang mở, nên xóa mềm/khôi phục cũng phải bỏ giá trị cũ
+            transaction.on_commit(lambda: snapshots.forget_end_time(self.pk))
+        if reschedule:
+            # Đóng đúng hạn bằng task có ETA; task cũ khi end_time bị dời chỉ còn là thao tác rỗng
+            self._loaded_end_time = self.end_time
+            end_time = self.end_time
+            transaction.on_commit(lambda: close_survey.apply_async((self.pk,), eta=end_time))
+
+    def has_ended(self):
+        return self.end_time <= timezone.now()
+
+    @classmethod
+    def close_expired(cls, **filters):
+        # Đóng (active=False) mọi khảo sát đã hết hạn bằng một UPDATE theo tập, dùng chỉ mục end_time.
+        # deleted_date giữ nguyên để khảo sát đã đóng không bị xóa vĩnh viễn như bài viết đã xóa mềm
+        from .tasks import remove_post_from_feeds
+
+        now = timezone.now()
+        closed = list(cls.objects.filter(active=True, end_time__lte=now, **filters).values_list('id', flat=True))
+        if closed:
+            Post.objects.filter(pk__in=closed, active=True).update(active=False, updated_date=now)
+            search.delete_post_documents(closed)
+            snapshots.forget_end_time(*closed)
+            for survey_id in closed:
+                transaction.on_commit(lambda survey_id=survey_id: remove_post_from_feeds.delay(survey_id))
+        return closed
+
+    @classmethod
+    def bump_questions_version(cls, **filters):
+        # updated_date cũng đổi để ETag của trang chi tiết không trả về câu hỏi cũ
+        cls.objects.filter(**filters).update(questions_version=F('questions_version') + 1,
+                                             updated_date=timezone.now())
+
+    def question_snapshot(self):
+        return snapshots.get_snapshot(self.pk, self.questions_version)
+
+    def add_questions(self, questions):
+        # questions là dữ liệu đã qua SurveyQuestionSerializer; tạo toàn bộ câu hỏi rồi toàn bộ lựa chọn
+        # bằng hai lệnh bulk_create
+        created = SurveyQuestion.objects.bulk_create([
+            SurveyQuestion(survey_post=self, question=question['question'],
+                           multi_choice=question.get('multi_choice', False))
+            for question in questions])
+        if created and created[0].pk is None:
+            # MySQL không trả về khóa chính sau bulk_create; câu hỏi vừa tạo là các id lớn nhất của khảo sát
+            pks = self.questions.order_by('-id').values_list('id', flat=True)[:len(created)]
+            for question, pk in zip(created, reversed(list(pks))):
+                question.pk = pk
+        SurveyOption.objects.bulk_create([
+            SurveyOption(survey_question=question, option=option['option'])
+            for question, data in zip(created, questions) for option in data['options']])
+        # Phiên bản được tăng một lần cho cả lô; view cập nhật xóa câu hỏi cũ rồi dựa vào lần tăng này
+        SurveyPost.bump_questions_version(pk=self.pk)
+        self.refresh_from_db(fields=['questions_version', 'updated_date'])
+        return created
+
+    def submit(self, user, answers):
+        # answers có dạng {question_id: [option_id, ...]}; toàn bộ lựa chọn được kiểm tra trên bản chụp câu hỏi
+        # và được ghi trong một transaction, SurveySubmission chặn việc nộp hai lần kể cả khi nộp đồng thời
+        if self.has_ended():
+            raise ValidationError("This survey has ended.")
+        if not isinstance(answers, dict):
+            raise ValidationError("Answers must be an object of question id to option ids.")
+        try:
+            selected = {int(question_id): {int(option_id) for option_id in option_ids}
+                        for question_id, option_ids in answers.items()}
+        except (TypeError, ValueError):
+            raise ValidationError("Question and option ids must be integers.")
+
+        questions = snapshots.get_rules(self.pk, self.questions_version)
+
+        if set(questions) - {question_id for question_id, option_ids in selected.items() if option_ids}:
+            raise ValidationError("You must answer all questions.")
+        for question_id, option_ids in selected.items():
+            question = questions.get(question_id)
+            if question is None or option_ids - question[1]:
+                raise ValidationError(f"Invalid options for question {question_id}.")
+            if not question[0] and len(option_ids) > 1:
+                raise ValidationError(f"Question {question_id} accepts only one option.")
+
+        option_ids = [option_id for option_ids in selected.values() for option_id in option_ids]
+        try:
+            with transaction.atomic():
+                SurveySubmission.objects.create(survey_post=self, user=user)
+                UserSurveyOption.objects.bulk_create(
+                    [UserSurveyOption(user=user, survey_option_id=option_id) for option_id in option_ids],
+                    ignore_conflicts=True)
+                SurveyOption.objects.filter(pk__in=option_ids).update(vote_count=F('vote_count') + 1)
+                SurveyQuestion.objects.filter(pk__in=selected).update(respondent_count=F('respondent_count') + 1)
+                SurveyDraft.objects.filter(user=user, survey_post=self).delete()
+                # Bản nháp còn trong bộ đệm bị bỏ cùng lúc với bản nháp trong CSDL
+                transaction.on_commit(lambda: drafts.discard(self.pk, user.pk))
+        except IntegrityError:
+            raise ValidationError("You had completed this survey.")
+
+    def results(self):
+        # Đọc bộ đếm của mọi câu hỏi và lựa chọn bằng một truy vấn (LEFT JOIN để giữ câu hỏi chưa có lựa chọn)
+        questions = {}
+        for row in SurveyQuestion.objects.filter(survey_post=self).order_by('id', 'options__id').values(
+                'id', 'question', 'multi_choice', 'respondent_count', 'options__id', 'options__option',
+                'options__vote_count'):
+            question = questions.setdefault(row['id'], {
+                'id': row['id'],
+                'question': row['question'],
+                'multi_choice': row['multi_choice'],
+                'respondents': row['respondent_count'],
+                'options': [],
+            })
+            if row['options__id'] is not None:
+                question['options'].append({'id': row['options__id'], 'text': row['options__option'],
+                                            'count': row['options__vote_count']})
+        return list(questions.values())
+
+    def has_completed(self, user):
+        return SurveySubmission.objects.filter(survey_post=self, user=user).exists()
+
 
 class SurveyQuestion(models.Model):
     question = models.TextField()
     multi_choice = models.BooleanField(default=False)
+    # Số người đã trả lời câu hỏi, được cập nhật khi nộp khảo sát
+    respondent_count = models.IntegerField(default=0, editable=False)
 
     survey_post = models.ForeignKey(SurveyPost, on_delete=models.CASCADE, related_name='questions')
 
@@ -150,6 +407,8 @@ class SurveyQuestion(models.Model):
 
 class SurveyOption(models.Model):
     option = models.TextField()
+    # Số lượt chọn, được cập nhật khi nộp khảo sát
+    vote_count = models.IntegerField(default=0, editable=False)
 
     survey_question = models.ForeignKey(SurveyQuestion, on_delete=models.CASCADE, related_name='options')
 
@@ -165,6 +424,15 @@ class UserSurveyOption(models.Model):
         unique_together = ('user', 'survey_option')
 
 
+class SurveySubmission(models.Model):
+    survey_post = models.ForeignKey(SurveyPost, on_delete=models.CASCADE, related_name='submissions')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='survey_submissions')
+    submitted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('survey_post', 'user')
+
+
 class SurveyDraft(models.Model):
     survey_post = models.ForeignKey(SurveyPost, on_delete=models.CASCADE, related_name='drafts')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='drafts')
@@ -185,6 +453,8 @@ class Group(BaseModel):
 
 
 class InvitationPost(Post):
+    POST_TYPE = PostType.INVITATION
+
     event_name = models.CharField(max_length=255)
 
     users = models.ManyToManyField(User, blank=True)
@@ -193,14 +463,79 @@ class InvitationPost(Post):
     def __str__(self):
         return self.event_name
 
+    def add_invitees(self, user_ids, group_ids):
+        # Một lệnh bulk insert cho mỗi quan hệ; id đã được kiểm tra trước
+        self.users.through.objects.bulk_create(
+            [self.users.through(invitationpost_id=self.pk, user_id=user_id) for user_id in user_ids],
+            ignore_conflicts=True)
+        self.groups.through.objects.bulk_create(
+            [self.groups.through(invitationpost_id=self.pk, group_id=group_id) for group_id in group_ids],
+            ignore_conflicts=True)
+
+    def recipient_emails(self):
+        # Người được mời trực tiếp và thành viên các nhóm được mời trong một truy vấn; mỗi người một lần
+        members = Group.users.through.objects.filter(group__in=self.groups.filter(active=True)).values('user_id')
+        return User.objects.filter(Q(pk__in=self.users.values('pk')) | Q(pk__in=members), is_active=True).values_list(
+            'email', flat=True)
+
 
 class Interaction(BaseModel):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
 
+    # Các trường quyết định bộ đếm nào tính bản ghi này; luôn được lưu cùng nhau để bộ đếm khớp với CSDL
+    COUNTED_BY = ('active',)
+
     class Meta:
         abstract = True
 
+    def get_counter_fields(self):
+        return []
+
+    def counted_fields(self):
+        # Các bộ đếm của bài viết đang tính bản ghi này; bản ghi đã xóa mềm không được tính
+        return self.get_counter_fields() if self.active else []
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields():
+            instance._counted_fields = instance.counted_fields()
+        return instance
+
+    def update_post_counters(self, delta, fields=None):
+        fields = self.get_counter_fields() if fields is None else fields
+        if fields:
+            from .feeds import invalidate_post
+
+            Post.objects.filter(pk=self.post_id).update(updated_date=timezone.now(),
+                                                        **{field: F(field) + delta for field in fields})
+            invalidate_post(self.post_id)
+
+    def save(self, *args, **kwargs):
+        # So sánh bộ đếm đang tính với trạng thái sau khi lưu (xóa mềm, khôi phục, đổi loại cảm xúc,
+        # kể cả khi đổi loại lúc đang bị xóa) nên các bộ đếm không bị lệch
+        counted = [] if self._state.adding else getattr(self, '_counted_fields', None)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], *self.COUNTED_BY}
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            current = self.counted_fields()
+            if counted is not None and counted != current:
+                self.update_post_counters(-1, [field for field in counted if field not in current])
+                self.update_post_counters(1, [field for field in current if field not in counted])
+        self._counted_fields = current
+
+    def soft_delete(self, using=None, keep_parents=False):
+        if not self.active:
+            return
+        super().soft_delete(using, keep_parents)
+
+    def restore(self, using=None, keep_parents=False):
+        if self.active:
+            return
+        super().restore(using, keep_parents)
+
 
 class ReactionType(IntEnum):
     LIKE = 1
@@ -215,23 +550,76 @@ class ReactionType(IntEnum):
 class Reaction(Interaction):
     reaction = models.IntegerField(choices=ReactionType.choices(), default=ReactionType.LIKE.value)
 
+    COUNTED_BY = ('active', 'reaction')
+
     class Meta:
         unique_together = ('user', 'post')
 
     def __str__(self):
         return f"{self.user.username} - {ReactionType(self.reaction).name} on Post {self.post.id}"
 
+    @staticmethod
+    def counter_field(reaction):
+        return f"{ReactionType(reaction).name.lower()}_count"
+
+    def get_counter_fields(self):
+        return [self.counter_field(self.reaction)]
+
 
 class Comment(Interaction):
     content = models.TextField(null=False)
     image = CloudinaryField('Comment Image', null=True, blank=True, folder='MangXaHoi')
+    upload_status = models.IntegerField(choices=UploadStatus.choices(), default=UploadStatus.READY.value)
 
     parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE)
+    # Đường dẫn id các bình luận tổ tiên, mỗi bậc PATH_STEP ký tự, ví dụ "0000000012/0000000034/"
+    path = models.CharField(max_length=255, default='', blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    PATH_STEP = 11
+    MAX_DEPTH = 255 // PATH_STEP
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'active', 'path'], name='comment_thread_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.parent_id:
+            parent = self.parent
+            if parent.depth >= self.MAX_DEPTH:
+                # path không chứa thêm được một bậc nữa
+                raise ValidationError("This comment has reached the maximum reply depth.")
+            self.path = parent.subtree_path()
+            self.depth = parent.depth + 1
+        super().save(*args, **kwargs)
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'content', 'active'} & set(update_fields):
+            search.index_comment(self)
+
+    def subtree_path(self):
+        return f"{self.path}{self.id:010d}/"
 
     def get_replies(self):
         return Comment.objects.filter(parent=self).order_by("created_date")
 
+    def get_counter_fields(self):
+        if self.parent_id:
+            return ['comment_count']
+        return ['comment_count', 'top_level_comment_count']
+
     def __str__(self):
         if self.parent:
             return f"Reply to {self.parent.id} - {self.content[:30]}"
         return self.content[:30]
+
+
+class SearchDocument(models.Model):
+    # Nội dung đã bỏ dấu của bài viết (comment rỗng) hoặc bình luận; trên MySQL có chỉ mục FULLTEXT
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='+')
+    comment = models.ForeignKey(Comment, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    content = models.TextField()
+
+    class Meta:
+        unique_together = ('post', 'comment')
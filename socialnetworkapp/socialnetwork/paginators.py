@@ -1,4 +1,27 @@
 from rest_framework import pagination
 
 class Pagination(pagination.PageNumberPagination):
-    page_size = 10
\ No newline at end of file
+    page_size = 10
+
+
+class PostPagination(pagination.CursorPagination):
+    # Mặc định phân trang theo cursor (không COUNT, không OFFSET); gửi ?page= để dùng phân trang theo số trang
+    ordering = ('-created_date', '-id')
+    page_query_param = pagination.PageNumberPagination.page_query_param
+    page_number_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_query_param in request.query_params:
+            self.page_number_paginator = pagination.PageNumberPagination()
+            return self.page_number_paginator.paginate_queryset(queryset.order_by(*self.ordering), request, view=view)
+        return super().paginate_queryset(queryset, request, view=view)
+
+    def get_paginated_response(self, data):
+        if self.page_number_paginator:
+            return self.page_number_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.page_number_paginator:
+            return self.page_number_paginator.to_html()
+        return super().to_html()
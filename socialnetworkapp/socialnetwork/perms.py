@@ -3,7 +3,7 @@ from rest_framework import permissions
 
 class OwnerPermission(permissions.IsAuthenticated):
     def has_object_permission(self, request, view, object):
-        return super().has_permission(request, view) and request.user == object.user
+        return super().has_permission(request, view) and request.user == getattr(object, 'user', object)
 
 
 class AdminPermission(permissions.BasePermission):
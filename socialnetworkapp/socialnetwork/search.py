@@ -0,0 +1,139 @@
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+TOKEN_RE = re.compile(r'\w+')
+
+
+def fold(text):
+    # Bỏ dấu tiếng Việt để "truong" khớp với "trường"
+    text = (text or '').replace('đ', 'd').replace('Đ', 'D')
+    text = unicodedata.normalize('NFD', text)
+    return ''.join(c for c in text if unicodedata.category(c) != 'Mn').lower()
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(fold(text))
+
+
+class MemorySearchIndex:
+    # Chỉ mục đảo trong bộ nhớ cho SQLite và khi kiểm thử; được nạp từ SearchDocument ở lần dùng đầu tiên
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.total_length = 0
+
+    def load(self):
+        from .models import SearchDocument
+
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            for document in SearchDocument.objects.values_list('post_id', 'comment_id', 'content').iterator():
+                self.add((document[0], document[1]), document[2])
+
+    def add(self, key, content):
+        with self.lock:
+            self.remove(key)
+            counts = Counter(TOKEN_RE.findall(content))
+            for token, count in counts.items():
+                self.postings[token][key] = count
+            self.documents[key] = counts
+            self.total_length += sum(counts.values())
+
+    def remove(self, key):
+        with self.lock:
+            counts = self.documents.pop(key, {})
+            self.total_length -= sum(counts.values())
+            for token in counts:
+                postings = self.postings[token]
+                postings.pop(key, None)
+                if not postings:
+                    del self.postings[token]
+
+    def search(self, query, limit):
+        self.load()
+        with self.lock:
+            total = len(self.documents)
+            if not total:
+                return []
+            average_length = self.total_length / total or 1
+            scores = defaultdict(float)
+            # BM25
+            for token in set(TOKEN_RE.findall(fold(query))):
+                postings = self.postings.get(token, {})
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for key, count in postings.items():
+                    norm = 1.2 * (0.25 + 0.75 * sum(self.documents[key].values()) / average_length)
+                    scores[key] += idf * count * 2.2 / (count + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:limit]
+
+
+memory_index = MemorySearchIndex()
+
+
+def use_fulltext():
+    return connection.vendor == 'mysql'
+
+
+def save_document(post_id, comment_id, text):
+    from .models import SearchDocument
+
+    content = ' '.join(tokenize(text))
+    SearchDocument.objects.update_or_create(post_id=post_id, comment_id=comment_id, defaults={'content': content})
+    if memory_index.loaded:
+        memory_index.add((post_id, comment_id), content)
+
+
+def delete_document(post_id, comment_id):
+    from .models import SearchDocument
+
+    SearchDocument.objects.filter(post_id=post_id, comment_id=comment_id).delete()
+    memory_index.remove((post_id, comment_id))
+
+
+def delete_post_documents(post_ids):
+    from .models import SearchDocument
+
+    SearchDocument.objects.filter(post_id__in=post_ids, comment__isnull=True).delete()
+    for post_id in post_ids:
+        memory_index.remove((post_id, None))
+
+
+def index_post(post):
+    if post.active:
+        save_document(post.pk, None, ' '.join(filter(None, [post.content, getattr(post, 'event_name', None)])))
+    else:
+        delete_document(post.pk, None)
+
+
+def index_comment(comment):
+    if comment.active:
+        save_document(comment.post_id, comment.pk, comment.content)
+    else:
+        delete_document(comment.post_id, comment.pk)
+
+
+def search(query, limit=50):
+    # Trả về [((post_id, comment_id), score)] theo thứ tự độ liên quan giảm dần
+    from .models import SearchDocument
+
+    if not tokenize(query):
+        return []
+
+    if not use_fulltext():
+        return memory_index.search(query, limit)
+
+    match = RawSQL(f"MATCH ({SearchDocument._meta.db_table}.content) AGAINST (%s IN NATURAL LANGUAGE MODE)",
+                   [' '.join(tokenize(query))])
+    documents = SearchDocument.objects.annotate(score=match).filter(score__gt=0).order_by('-score')[:limit]
+    return [((post_id, comment_id), score) for post_id, comment_id, score in
+            documents.values_list('post_id', 'comment_id', 'score')]
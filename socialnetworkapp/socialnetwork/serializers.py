@@ -2,13 +2,134 @@ from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer, ValidationError, Serializer, CharField, PrimaryKeyRelatedField
 from .models import User, Alumni, Teacher, Post, PostImage, Comment, SurveyOption, SurveyQuestion, SurveyPost, \
     SurveyDraft, UserSurveyOption, Reaction, Group, InvitationPost
+from .media import upload_later, image_size_urls, image_url
 from .tasks import send_email_async
+from . import snapshots
+from django.db import models, transaction
 from django.utils import timezone
-from cloudinary.uploader import upload
-from cloudinary.exceptions import Error
 
 
-class UserSerializer(ModelSerializer):
+def parse_field_paths(value):
+    # "id,user.username,user.avatar" -> {'id': {}, 'user': {'username': {}, 'avatar': {}}}
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in filter(None, path.strip().split('.')):
+            node = node.setdefault(name, {})
+    return tree
+
+
+class DynamicFieldsMixin:
+    # ?fields= chỉ trả về các trường được chọn, ?expand= chỉ lồng các quan hệ được chọn, các quan hệ còn lại trả về id
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def __init__(self, *args, **kwargs):
+        self.requested_fields = kwargs.pop('requested_fields', None)
+        self.expanded_fields = kwargs.pop('expanded_fields', None)
+        super().__init__(*args, **kwargs)
+
+    def is_root(self):
+        return self.parent is None or (isinstance(self.parent, serializers.ListSerializer) and self.parent.parent is None)
+
+    def get_fields(self):
+        fields = super().get_fields()
+
+        request = self.context.get('request')
+        if self.is_root() and request is not None and request.method == 'GET':
+            if self.fields_query_param in request.query_params:
+                self.requested_fields = parse_field_paths(request.query_params[self.fields_query_param])
+            if self.expand_query_param in request.query_params:
+                self.expanded_fields = parse_field_paths(request.query_params[self.expand_query_param])
+
+        if self.requested_fields:
+            fields = {name: field for name, field in fields.items() if name in self.requested_fields}
+
+        for name, field in list(fields.items()):
+            many = isinstance(field, serializers.ListSerializer)
+            nested = field.child if many else field
+            if not isinstance(nested, serializers.BaseSerializer):
+                continue
+            if self.expanded_fields is not None and name not in self.expanded_fields:
+                fields[name] = PrimaryKeyRelatedField(read_only=True, many=many, source=field.source)
+            elif isinstance(nested, DynamicFieldsMixin):
+                if self.requested_fields:
+                    nested.requested_fields = self.requested_fields[name]
+                if self.expanded_fields is not None:
+                    nested.expanded_fields = self.expanded_fields[name]
+
+        return fields
+
+
+class EagerLoadingMixin:
+    # Mỗi serializer khai báo quan hệ của riêng nó; quan hệ của serializer lồng nhau được gộp vào tự động.
+    # Chỉ các quan hệ thực sự được trả về (sau ?fields=/?expand=) mới được nạp.
+    select_related_fields = []
+    prefetch_related_fields = []
+
+    def get_related_paths(self, prefix=''):
+        fields = {field.source: field for field in self.fields.values()}
+
+        def is_nested(field):
+            return isinstance(field, serializers.BaseSerializer)
+
+        select_related = [prefix + path for path in self.select_related_fields
+                          if is_nested(fields.get(path.split('__')[0]))]
+        prefetch_related = [prefix + path for path in self.prefetch_related_fields
+                            if path.split('__')[0] in fields]
+
+        for source, field in fields.items():
+            many = isinstance(field, serializers.ListSerializer)
+            child = field.child if many else field
+            if not isinstance(child, EagerLoadingMixin):
+                continue
+            child_select, child_prefetch = child.get_related_paths(f"{prefix}{source}__")
+            if many:
+                prefetch_related += child_select + child_prefetch
+            else:
+                select_related += child_select
+                prefetch_related += child_prefetch
+
+        return select_related, prefetch_related
+
+    def setup_eager_loading(self, queryset):
+        select_related, prefetch_related = self.get_related_paths()
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+
+class MediaField(serializers.Field):
+    # Trả về URL ảnh gốc, hoặc URL của kích thước được chọn bằng ?img=thumb.
+    # Khi ghi, file tải lên được giữ nguyên để đưa vào media pipeline
+    img_query_param = 'img'
+
+    def to_internal_value(self, data):
+        return data
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        size = request.query_params.get(self.img_query_param) if request is not None else None
+        return image_url(value, size)
+
+
+class MediaSizesField(serializers.Field):
+    # {"thumb": url, "feed": url, "full": url} của trường ảnh cùng tên, trả về ở khóa <tên>_sizes
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return image_size_urls(value)
+
+
+class UserSerializer(DynamicFieldsMixin, ModelSerializer):
+    avatar = MediaField(required=False)
+    cover = MediaField(required=False, allow_null=True)
+    avatar_sizes = MediaSizesField(source='avatar')
+    cover_sizes = MediaSizesField(source='cover')
 
     def create(self, validated_data):
         data = validated_data.copy()
@@ -20,7 +141,8 @@ class UserSerializer(ModelSerializer):
 
     class Meta:
         model = User
-        fields = ["id", "username", "password", "avatar", "cover", "first_name", "last_name", "email", "role"]
+        fields = ["id", "username", "password", "avatar", "cover", "avatar_sizes", "cover_sizes", "first_name",
+                  "last_name", "email", "role"]
         extra_kwargs = {
             'password': {
                 'write_only': True,
@@ -29,39 +151,85 @@ class UserSerializer(ModelSerializer):
         }
 
 
-class PostImageSerializer(ModelSerializer):
+class PostImageSerializer(DynamicFieldsMixin, ModelSerializer):
+    image = MediaField(read_only=True)
+    image_sizes = MediaSizesField(source='image')
+
     class Meta:
         model = PostImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'image_sizes', 'upload_status']
+
 
+class PostSerializer(DynamicFieldsMixin, EagerLoadingMixin, ModelSerializer):
+    select_related_fields = ['user']
+    prefetch_related_fields = ['images']
 
-class PostSerializer(ModelSerializer):
     images = PostImageSerializer(many=True, required=False)
     user = UserSerializer(read_only=True)
-    object_type = serializers.SerializerMethodField()
+    object_type = serializers.CharField(read_only=True)
 
     class Meta:
         model = Post
-        fields = ['id', 'content', 'images', 'lock_comment', 'user', 'created_date', 'updated_date', 'object_type']
+        fields = ['id', 'content', 'images', 'lock_comment', 'user', 'created_date', 'updated_date', 'object_type',
+                  'comment_count', 'top_level_comment_count', 'like_count', 'haha_count', 'love_count']
 
-    def get_object_type(self, obj):
-        if SurveyPost.objects.filter(pk=obj.pk).exists():
-            return "survey"
-        elif InvitationPost.objects.filter(pk=obj.pk).exists():
-            return "invitation"
-        return "post"
 
+class CommentSerializer(DynamicFieldsMixin, EagerLoadingMixin, ModelSerializer):
+    select_related_fields = ['user']
 
-class CommentSerializer(ModelSerializer):
     user = UserSerializer(read_only=True)
     post = PostSerializer(read_only=True)
+    image = MediaField(read_only=True)
+    image_sizes = MediaSizesField(source='image')
 
     class Meta:
         model = Comment
-        fields = ['id', 'user', 'content', 'image', 'post', 'parent', 'created_date', 'updated_date']
+        fields = ['id', 'user', 'content', 'image', 'image_sizes', 'upload_status', 'post', 'parent', 'created_date',
+                  'updated_date']
+
+
+class CommentUserSerializer(ModelSerializer):
+    avatar = MediaField(read_only=True)
+    avatar_sizes = MediaSizesField(source='avatar')
+
+    class Meta:
+        model = User
+        fields = ["id", "username", "first_name", "last_name", "avatar", "avatar_sizes"]
+
+
+class CommentThreadSerializer(EagerLoadingMixin, ModelSerializer):
+    select_related_fields = ['user']
 
+    user = CommentUserSerializer(read_only=True)
+    image = MediaField(read_only=True)
+    image_sizes = MediaSizesField(source='image')
+
+    class Meta:
+        model = Comment
+        fields = ['id', 'user', 'content', 'image', 'image_sizes', 'upload_status', 'parent', 'depth', 'created_date',
+                  'updated_date']
+
+    @classmethod
+    def build_tree(cls, comments, base_depth=0):
+        # base_depth là độ sâu của gốc được yêu cầu (0 cho cả bài viết, root.depth cho một nhánh);
+        # bình luận có cha đã bị xóa (không nằm trong danh sách) sẽ không được hiển thị
+        nodes = {}
+        for data in cls(comments, many=True).data:
+            data['replies'] = []
+            nodes[data['id']] = data
+        roots = []
+        for data in nodes.values():
+            parent = nodes.get(data['parent'])
+            if parent is not None:
+                parent['replies'].append(data)
+            elif data['depth'] == base_depth:
+                roots.append(data)
+        return roots
+
+
+class ReactionSerializer(DynamicFieldsMixin, EagerLoadingMixin, ModelSerializer):
+    select_related_fields = ['user']
 
-class ReactionSerializer(ModelSerializer):
     user = UserSerializer(read_only=True)
     post = PostSerializer(read_only=True)
 
@@ -81,7 +249,17 @@ class ChangePasswordSerializer(Serializer):
         return value
 
 
-class AlumniSerializer(ModelSerializer):
+def upload_user_images(user, avatar, cover):
+    # Avatar mặc định được giữ cho tới khi Celery đăng xong ảnh
+    for field_name, image in (('avatar', avatar), ('cover', cover)):
+        if image:
+            try:
+                upload_later(user, field_name, image)
+            except OSError as e:
+                raise ValidationError({field_name: f"Lỗi đăng tải {field_name}: {str(e)}"})
+
+
+class AlumniSerializer(DynamicFieldsMixin, ModelSerializer):
     user = UserSerializer()
 
     class Meta:
@@ -99,39 +277,26 @@ class AlumniSerializer(ModelSerializer):
         if not password:
             raise ValidationError({"password": "Yêu cầu mật khẩu."})
 
-        if avatar:
-            try:
-                avatar_result = upload(avatar, folder="MangXaHoi")
-                user_data['avatar'] = avatar_result.get('secure_url')
-            except Error as e:
-                raise ValidationError({"avatar": f"Lỗi đăng tải avatar: {str(e)}"})
-        else:
+        if not avatar:
             raise ValidationError({"avatar": "Yêu cầu ảnh đại diện."})
 
-        if cover:
-            try:
-                cover_result = upload(cover, folder="MangXaHoi")
-                user_data['cover'] = cover_result.get('secure_url')
-            except Error as e:
-                raise ValidationError({"cover": f"Lỗi đăng tải cover: {str(e)}"})
-
-        user = User.objects.create_user(
-            username=user_data.get('username'),
-            password=password,
-            first_name=user_data.get('first_name'),
-            last_name=user_data.get('last_name'),
-            email=user_data.get('email'),
-            avatar=user_data.get('avatar'),
-            cover=user_data.get('cover'),
-            role=user_data.get('role'),
-            is_active=user_data.get('is_active')
-        )
-
-        alumni = Alumni.objects.create(user=user, **validated_data)
+        with transaction.atomic():
+            user = User.objects.create_user(
+                username=user_data.get('username'),
+                password=password,
+                first_name=user_data.get('first_name'),
+                last_name=user_data.get('last_name'),
+                email=user_data.get('email'),
+                role=user_data.get('role'),
+                is_active=user_data.get('is_active')
+            )
+            upload_user_images(user, avatar, cover)
+
+            alumni = Alumni.objects.create(user=user, **validated_data)
         return alumni
 
 
-class TeacherSerializer(ModelSerializer):
+class TeacherSerializer(DynamicFieldsMixin, ModelSerializer):
     user = UserSerializer()
 
     class Meta:
@@ -145,32 +310,18 @@ class TeacherSerializer(ModelSerializer):
         cover = user_data.pop('cover', None)
         password = 'ou@123'
 
-        if avatar:
-            try:
-                avatar_result = upload(avatar, folder="MangXaHoi")
-                user_data['avatar'] = avatar_result.get('secure_url')
-            except Error as e:
-                raise ValidationError({"avatar": f"Lỗi đăng tải avatar: {str(e)}"})
-
-        if cover:
-            try:
-                cover_result = upload(cover, folder="MangXaHoi")
-                user_data['cover'] = cover_result.get('secure_url')
-            except Error as e:
-                raise ValidationError({"cover": f"Lỗi đăng tải cover: {str(e)}"})
-
-        user = User.objects.create_user(
-            username=user_data.get('username'),
-            password=password,
-            first_name=user_data.get('first_name'),
-            last_name=user_data.get('last_name'),
-            email=user_data.get('email'),
-            avatar=user_data.get('avatar'),
-            cover=user_data.get('cover'),
-            role=user_data.get('role')
-        )
-
-        teacher = Teacher.objects.create(user=user, must_change_password=True)
+        with transaction.atomic():
+            user = User.objects.create_user(
+                username=user_data.get('username'),
+                password=password,
+                first_name=user_data.get('first_name'),
+                last_name=user_data.get('last_name'),
+                email=user_data.get('email'),
+                role=user_data.get('role')
+            )
+            upload_user_images(user, avatar, cover)
+
+            teacher = Teacher.objects.create(user=user, must_change_password=True)
         teacher.password_reset_time = timezone.now()
 
         send_email_async.delay(
@@ -197,26 +348,54 @@ class TeacherSerializer(ModelSerializer):
 
 
 
-class SurveyOptionSerializer(serializers.ModelSerializer):
+class SurveyOptionSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = SurveyOption
         fields = ['id', 'option']
 
 
-class SurveyQuestionSerializer(serializers.ModelSerializer):
+class SurveyQuestionSerializer(DynamicFieldsMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    prefetch_related_fields = ['options']
+
     options = SurveyOptionSerializer(many=True, required=True)
 
     class Meta:
         model = SurveyQuestion
         fields = ['id', 'question', 'multi_choice', 'options']
 
+    def validate_options(self, value):
+        # Cùng quy tắc với SurveyQuestion.clean nhưng kiểm tra trước khi tạo bản ghi
+        if len(value) < 2:
+            raise ValidationError("Each question must have at least 2 options.")
+        return value
+
+
+class SurveyPostListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Nạp bản chụp câu hỏi của cả trang một lần thay vì một lượt cache (và truy vấn khi cache trống) mỗi khảo sát
+        survey_posts = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        self.child.loaded_snapshots = snapshots.get_snapshots(
+            (survey_post.pk, survey_post.questions_version) for survey_post in survey_posts)
+        return super().to_representation(survey_posts)
+
 
 class SurveyPostSerializer(PostSerializer):
-    questions = SurveyQuestionSerializer(many=True, required=False)
+    select_related_fields = []
+    loaded_snapshots = {}
+
+    # Đọc từ bản chụp câu hỏi đã cache thay vì duyệt serializer lồng nhau
+    questions = serializers.SerializerMethodField()
 
     class Meta:
         model = SurveyPost
         fields = ['id', 'end_time', 'survey_type', 'questions']
+        list_serializer_class = SurveyPostListSerializer
+
+    def get_questions(self, survey_post):
+        key = (survey_post.pk, survey_post.questions_version)
+        if key in self.loaded_snapshots:
+            return self.loaded_snapshots[key]
+        return survey_post.question_snapshot()
 
 class UserSurveyOptionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -224,19 +403,24 @@ class UserSurveyOptionSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'survey_option']
 
 
-class SurveyDraftSerializer(serializers.ModelSerializer):
+class SurveyDraftSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = SurveyDraft
         fields = ['id', 'survey_post', 'user', 'answers', 'drafted_at']
 
 
-class GroupSerializer(serializers.ModelSerializer):
+class GroupSerializer(DynamicFieldsMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    prefetch_related_fields = ['users']
+
     class Meta:
         model = Group
         fields = ['id', 'group_name', 'users', 'created_date', 'updated_date']
 
 
-class InvitationPostSerializer(serializers.ModelSerializer):
+class InvitationPostSerializer(DynamicFieldsMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = ['user']
+    prefetch_related_fields = ['images', 'users', 'groups']
+
     users = PrimaryKeyRelatedField(many=True, queryset=User.objects.filter(is_active=True), required=False)
     groups = PrimaryKeyRelatedField(many=True, queryset=Group.objects.filter(active=True), required=False)
     images = PostImageSerializer(many=True, required=False)
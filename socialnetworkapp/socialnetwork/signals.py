@@ -0,0 +1,31 @@
+import logging
+
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .media import get_media_backend, release_asset, stored_url
+from .models import MediaAsset, PostImage, Comment, User
+
+logger = logging.getLogger(__name__)
+
+
+# QuerySet.delete() và xóa dây chuyền không gọi Model.delete() nên số tham chiếu được giảm qua signal
+@receiver(post_delete, sender=PostImage)
+@receiver(post_delete, sender=Comment)
+def release_image(sender, instance, **kwargs):
+    release_asset(stored_url(instance.image))
+
+
+@receiver(post_delete, sender=User)
+def release_user_images(sender, instance, **kwargs):
+    release_asset(stored_url(instance.avatar))
+    release_asset(stored_url(instance.cover))
+
+
+@receiver(post_delete, sender=MediaAsset)
+def delete_stored_file(sender, instance, **kwargs):
+    try:
+        get_media_backend().delete(instance.url)
+    except Exception as e:
+        logger.warning(f"Failed to delete media {instance.url}: {str(e)}")
+
@@ -0,0 +1,80 @@
+from functools import lru_cache
+
+from django.core.cache import cache
+
+SNAPSHOT_KEY = 'survey:snapshot:%s:%s'
+END_TIME_KEY = 'survey:end_time:%s'
+SNAPSHOT_TIMEOUT = 24 * 60 * 60
+
+
+def build_snapshots(survey_ids):
+    # {survey_id: câu hỏi}, cùng dạng với SurveyQuestionSerializer, đọc bằng một truy vấn cho mọi khảo sát
+    from .models import SurveyQuestion
+
+    surveys = {survey_id: {} for survey_id in survey_ids}
+    for row in SurveyQuestion.objects.filter(survey_post_id__in=surveys).order_by('id', 'options__id').values(
+            'survey_post_id', 'id', 'question', 'multi_choice', 'options__id', 'options__option'):
+        question = surveys[row['survey_post_id']].setdefault(row['id'], {
+            'id': row['id'],
+            'question': row['question'],
+            'multi_choice': row['multi_choice'],
+            'options': [],
+        })
+        if row['options__id'] is not None:
+            question['options'].append({'id': row['options__id'], 'option': row['options__option']})
+    return {survey_id: list(questions.values()) for survey_id, questions in surveys.items()}
+
+
+def build_snapshot(survey_id):
+    return build_snapshots([survey_id])[survey_id]
+
+
+@lru_cache(maxsize=512)
+def get_snapshot(survey_id, version):
+    # Khóa chứa questions_version nên bản chụp không bao giờ cần xóa: sửa câu hỏi tăng phiên bản và
+    # bản cũ tự rời khỏi LRU và hết hạn trong cache. Giá trị được dùng chung, không được sửa đổi
+    key = SNAPSHOT_KEY % (survey_id, version)
+    snapshot = cache.get(key)
+    if snapshot is None:
+        snapshot = build_snapshot(survey_id)
+        cache.set(key, snapshot, SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def get_snapshots(pairs):
+    # {(survey_id, version): bản chụp} cho cả một trang: một cache.get_many, các bản còn thiếu được dựng
+    # bằng một truy vấn chung và ghi lại bằng một cache.set_many
+    keys = {SNAPSHOT_KEY % pair: pair for pair in set(pairs)}
+    found = {keys[key]: snapshot for key, snapshot in cache.get_many(list(keys)).items()}
+    missing = [pair for pair in keys.values() if pair not in found]
+    if missing:
+        built = build_snapshots({survey_id for survey_id, _ in missing})
+        fresh = {pair: built[pair[0]] for pair in missing}
+        cache.set_many({SNAPSHOT_KEY % pair: snapshot for pair, snapshot in fresh.items()}, SNAPSHOT_TIMEOUT)
+        found.update(fresh)
+    return found
+
+
+@lru_cache(maxsize=512)
+def get_rules(survey_id, version):
+    # {question_id: (multi_choice, {option_id, ...})} để kiểm tra bài nộp; câu hỏi chưa có lựa chọn
+    # không thể trả lời nên không bắt buộc
+    return {question['id']: (question['multi_choice'], {option['id'] for option in question['options']})
+            for question in get_snapshot(survey_id, version) if question['options']}
+
+
+def get_end_time(survey_id):
+    # Thời điểm kết thúc của khảo sát đang mở, None nếu khảo sát không tồn tại hoặc đã đóng.
+    # Được cache (kể cả None) để bản nháp kiểm tra hạn mà không cần truy vấn
+    key = END_TIME_KEY % survey_id
+    value = cache.get(key)
+    if value is None:
+        from .models import SurveyPost
+
+        value = (SurveyPost.objects.filter(pk=survey_id, active=True).values_list('end_time', flat=True).first(),)
+        cache.set(key, value, SNAPSHOT_TIMEOUT)
+    return value[0]
+
+
+def forget_end_time(*survey_ids):
+    cache.delete_many([END_TIME_KEY % survey_id for survey_id in survey_ids])
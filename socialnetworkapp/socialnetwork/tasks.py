@@ -8,7 +8,8 @@ from django.db import DatabaseError
 from django.apps import apps
 import logging
 
-from socialnetwork.models import Teacher, BaseModel, SurveyPost
+from socialnetwork import drafts, emails, exports, feeds, media
+from socialnetwork.models import Teacher, BaseModel, SurveyPost, InvitationPost
 
 # Logger for celery tasks
 celery_logger = logging.getLogger('celery')
@@ -85,10 +86,77 @@ def delete_permanently_after_30_days():
 
 @shared_task
 def deactivate_expired_surveys():
-    now = timezone.now()
-    expired_surveys = SurveyPost.objects.filter(end_time__lte=now, is_active=True)
-    for survey in expired_surveys:
-        survey.is_active = False
+    # Lưới an toàn cho các task close_survey bị mất; mỗi lần chạy chỉ là một UPDATE theo chỉ mục end_time
+    closed = SurveyPost.close_expired()
+    celery_logger.info(f"Closed {len(closed)} expired surveys")
+    return f"Closed {len(closed)} expired surveys"
+
+
+@shared_task
+def close_survey(survey_id):
+    # Được hẹn giờ tại end_time; không làm gì nếu end_time đã bị dời về sau
+    closed = SurveyPost.close_expired(pk=survey_id)
+    return f"Survey {survey_id} closed" if closed else f"Survey {survey_id} still open"
+
+
+@shared_task
+def push_post_to_feeds(post_id):
+    feeds.fan_out_post(post_id)
+    return f"Post {post_id} pushed to feeds"
+
+
+@shared_task
+def remove_post_from_feeds(post_id):
+    feeds.remove_post(post_id)
+    return f"Post {post_id} removed from feeds"
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def process_upload(self, path, model_label, pk, field_name, content_hash=None):
+    model = apps.get_model(model_label)
+    try:
+        url = media.get_media_backend().upload(path)
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        celery_logger.error(f"Failed to upload {path} for {model_label} {pk}. Error: {str(e)}")
+        url = None
+
+    media.finish_upload(model, pk, field_name, url, content_hash)
+    media.discard(path)
+    return f"Uploaded {field_name} for {model_label} {pk}" if url else f"Upload failed for {model_label} {pk}"
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=30)
+def process_post_images(self, post_id, image_ids, paths, content_hashes=None):
+    try:
+        urls = media.upload_batch(paths, content_hashes or paths)
+    except Exception as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+        celery_logger.error(f"Failed to upload images for post {post_id}. Error: {str(e)}")
+        urls = None
+
+    media.finish_post_images(post_id, image_ids, urls, content_hashes)
+    for path in paths:
+        media.discard(path)
+    return f"Uploaded {len(paths)} images for post {post_id}" if urls else f"Image upload failed for post {post_id}"
+
+
+@shared_task
+def flush_survey_drafts():
+    flushed = drafts.flush()
+    if flushed:
+        celery_logger.info(f"Flushed {flushed} buffered survey drafts")
+    return f"Flushed {flushed} survey drafts"
+
+
+@shared_task
+def export_survey_responses(survey_id, export_format, file_name):
+    survey_post = SurveyPost.objects.get(pk=survey_id)
+    exports.write_export(survey_post, export_format, file_name)
+    celery_logger.info(f"Exported responses of survey {survey_id} to {file_name}")
+    return file_name
 
 
 @shared_task
@@ -100,4 +168,35 @@ def send_email_async(subject, message, recipient_email):
         recipient_list=[recipient_email],
         fail_silently=False,
     )
-    return f"Email sent to {recipient_email}"
\ No newline at end of file
+    return f"Email sent to {recipient_email}"
+
+
+@shared_task
+def fan_out_invitation(invitation_id):
+    # Đọc danh sách người nhận ở nền để request không phụ thuộc kích thước nhóm
+    invitation_post = InvitationPost.objects.filter(pk=invitation_id, active=True).first()
+    if invitation_post is None:
+        return f"Invitation {invitation_id} not found"
+    subject, message = emails.invitation_message(invitation_post)
+    recipients = dict.fromkeys(invitation_post.recipient_emails().iterator(chunk_size=2000))
+    queued = emails.queue_emails(subject, message, [(email, None) for email in recipients])
+    return f"Queued {queued} invitation emails for invitation {invitation_id}"
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def send_email_batch(self, subject, message, recipients, results=None):
+    # Một phiên SMTP cho cả lô thay vì một phiên cho mỗi thư; kết quả theo từng người nhận
+    results = results or {}
+    try:
+        results.update(emails.send_batch(subject, message, recipients))
+    except emails.BatchInterrupted as e:
+        results.update(e.results)
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, args=[subject, message, e.remaining, results])
+        celery_logger.error(f"Email batch interrupted, {len(e.remaining)} messages not sent. Error: {str(e)}")
+        results.update({email: str(e) for email, _ in e.remaining})
+
+    failed = {email: result for email, result in results.items() if result != 'sent'}
+    if failed:
+        celery_logger.warning(f"Failed to send {len(failed)} of {len(results)} emails: {failed}")
+    return results
@@ -0,0 +1,403 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import DatabaseError, connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import drafts, feeds, snapshots
+from .models import User, Post, PostImage, Comment, Reaction, ReactionType, SurveyPost, SurveyDraft, SurveyType, \
+    SurveySubmission, InvitationPost, Group
+
+
+class FeedTestCase(TestCase):
+    # Mọi kiểm thử dùng timeline trong bộ nhớ riêng, không chạm tới Redis thật
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(feeds, '_backend', feeds.MemoryFeedBackend({}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ReactionCounterTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alumni', password='secret', email='alumni@example.com', role=1)
+        self.post = Post.objects.create(content='Bài viết', user=self.user)
+
+    def assertCounters(self, like, haha, love):
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.haha_count, self.post.love_count), (like, haha, love))
+
+    def test_change_type(self):
+        reaction = Reaction.objects.create(user=self.user, post=self.post, reaction=ReactionType.LOVE.value)
+        self.assertCounters(0, 0, 1)
+        reaction = Reaction.objects.get(pk=reaction.pk)
+        reaction.reaction = ReactionType.HAHA.value
+        reaction.save()
+        self.assertCounters(0, 1, 0)
+
+    def test_soft_delete_is_idempotent(self):
+        reaction = Reaction.objects.create(user=self.user, post=self.post, reaction=ReactionType.LIKE.value)
+        reaction.soft_delete()
+        reaction.soft_delete()
+        self.assertCounters(0, 0, 0)
+
+    def test_change_type_while_deleted(self):
+        reaction = Reaction.objects.create(user=self.user, post=self.post, reaction=ReactionType.LOVE.value)
+        reaction.soft_delete()
+        self.assertCounters(0, 0, 0)
+
+        reaction = Reaction.objects.get(pk=reaction.pk)
+        reaction.reaction = ReactionType.LIKE.value
+        reaction.restore()
+        self.assertCounters(1, 0, 0)
+
+        reaction = Reaction.objects.get(pk=reaction.pk)
+        reaction.soft_delete()
+        reaction.reaction = ReactionType.HAHA.value
+        reaction.save()
+        reaction.restore()
+        self.assertCounters(0, 1, 0)
+
+
+class CommentThreadTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alumni', password='secret', email='alumni@example.com', role=1)
+        self.post = Post.objects.create(content='Bài viết', user=self.user)
+        self.top = Comment.objects.create(content='1', user=self.user, post=self.post)
+        self.reply = Comment.objects.create(content='1.1', user=self.user, post=self.post, parent=self.top)
+        self.nested = Comment.objects.create(content='1.1.1', user=self.user, post=self.post, parent=self.reply)
+
+    def get_thread(self, **params):
+        response = self.client.get(f'/post/{self.post.pk}/comments/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_orphans_are_hidden(self):
+        # Chỉ còn các phản hồi của một bình luận đã xóa: không có gốc ở độ sâu 0 nên không hiển thị gì
+        self.top.soft_delete()
+        self.assertEqual(self.get_thread(), [])
+
+    def test_subtree(self):
+        thread = self.get_thread(root=self.reply.pk)
+        self.assertEqual([comment['id'] for comment in thread], [self.reply.pk])
+        self.assertEqual([comment['id'] for comment in thread[0]['replies']], [self.nested.pk])
+
+    def test_reply_at_max_depth_is_rejected(self):
+        Comment.objects.filter(pk=self.nested.pk).update(depth=Comment.MAX_DEPTH)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(f'/comment/{self.nested.pk}/reply/', {'content': 'quá sâu'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Comment.objects.filter(content='quá sâu').exists())
+
+
+class MediaFieldTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alumni', password='secret', email='alumni@example.com', role=1)
+        Post.objects.create(content='Bài viết', user=self.user)
+
+    def get_user(self, **params):
+        response = self.client.get('/post/', {'page': 1, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results'][0]['user']
+
+    def test_image_fields_stay_strings(self):
+        # Ứng dụng di động gọi avatar.replace(...) nên trường ảnh phải luôn là chuỗi
+        user = self.get_user()
+        self.assertEqual(user['avatar'], user['avatar_sizes']['full'])
+        self.assertEqual(set(user['avatar_sizes']), {'thumb', 'feed', 'full'})
+
+    def test_img_selects_size(self):
+        user = self.get_user(img='thumb')
+        self.assertEqual(user['avatar'], user['avatar_sizes']['thumb'])
+        self.assertIn('w_150', user['avatar'])
+
+
+class DraftFlushTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alumni', password='secret', email='alumni@example.com', role=1)
+        self.survey = SurveyPost.objects.create(content='Khảo sát', user=self.user, survey_type=SurveyType.INCOME.value,
+                                                end_time=timezone.now() + timedelta(days=1))
+        patcher = mock.patch.object(drafts, '_backend', drafts.MemoryDraftBackend({}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_write_keeps_drafts(self):
+        drafts.save(self.survey.pk, self.user.pk, {'1': [1]})
+        with mock.patch.object(SurveyDraft.objects, 'bulk_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                drafts.flush()
+        self.assertEqual(drafts.get_draft_backend().dirty, {(self.survey.pk, self.user.pk)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(drafts.flush(), 1)
+        self.assertEqual(SurveyDraft.objects.get().answers, [{'question_id': '1', 'selected_options': [1]}])
+        self.assertEqual(drafts.get_draft_backend().get(self.survey.pk, self.user.pk), {})
+
+    def test_autosave_during_write_is_kept(self):
+        drafts.save(self.survey.pk, self.user.pk, {'1': [1]})
+        write_drafts = drafts.write_drafts
+
+        def write_and_autosave(pending):
+            written = write_drafts(pending)
+            drafts.save(self.survey.pk, self.user.pk, {'2': [3]})
+            return written
+
+        with mock.patch.object(drafts, 'write_drafts', write_and_autosave), self.captureOnCommitCallbacks(execute=True):
+            drafts.flush(batch_size=1)
+        self.assertEqual(drafts.get_draft_backend().get(self.survey.pk, self.user.pk), {'1': [1], '2': [3]})
+
+
+class SurveyDraftViewTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username='alumni', password='secret', email='alumni@example.com', role=1)
+        self.survey = SurveyPost.objects.create(content='Khảo sát', user=self.user, survey_type=SurveyType.INCOME.value,
+                                                end_time=timezone.now() + timedelta(days=1))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch.object(drafts, '_backend', drafts.MemoryDraftBackend({}))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_draft_after_submission_is_rejected(self):
+        SurveySubmission.objects.create(survey_post=self.survey, user=self.user)
+        response = self.client.post(f'/survey/{self.survey.pk}/draft/', {'answers': {'1': [1]}}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "You had completed this survey."})
+        self.assertEqual(drafts.get_draft_backend().get(self.survey.pk, self.user.pk), {})
+
+    def test_resume_unknown_survey(self):
+        self.assertEqual(self.client.get('/survey/abc/resume/').status_code, 404)
+
+
+class SurveyEndTimeTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username='alumni', password='secret', email='alumni@example.com', role=1)
+        self.survey = SurveyPost.objects.create(content='Khảo sát', user=self.user, survey_type=SurveyType.INCOME.value,
+                                                end_time=timezone.now() + timedelta(days=1))
+
+    def test_soft_delete_and_restore_forget_end_time(self):
+        self.assertEqual(snapshots.get_end_time(self.survey.pk), self.survey.end_time)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.survey.soft_delete()
+        self.assertIsNone(snapshots.get_end_time(self.survey.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.survey.restore()
+        self.assertEqual(snapshots.get_end_time(self.survey.pk), self.survey.end_time)
+
+
+class TimelineTests(FeedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user(username='alumni', password='secret', email='alumni@example.com', role=1,
+                                             first_name='An')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_profile_change_refreshes_cached_posts(self):
+        post = Post.objects.create(content='Bài viết', user=self.user)
+        response = self.client.get('/post/')
+        self.assertEqual([item['user']['first_name'] for item in response.json()['results']], ['An'])
+        self.assertIn(post.pk, feeds.get_feed_backend().posts)
+
+        self.user.first_name = 'Bình'
+        self.user.save()
+        response = self.client.get('/post/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['user']['first_name'] for item in response.json()['results']], ['Bình'])
+
+    def test_redis_outage_falls_back_to_database(self):
+        post = Post.objects.create(content='Bài viết', user=self.user)
+        with mock.patch.object(feeds.get_feed_backend(), 'range', side_effect=ConnectionError), \
+                self.assertLogs('socialnetwork.views', 'WARNING'):
+            response = self.client.get('/post/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['results']], [post.pk])
+
+
+class PostQueryCountTests(FeedTestCase):
+    # Số truy vấn của một trang không được tăng theo số bài viết (hay số ảnh của bài viết)
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.user = User.objects.create_user(username='alumni', password='secret', email='alumni@example.com', role=1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_posts(self, count, user=None):
+        # Đủ ba loại bài viết, mỗi bài có tác giả riêng (trừ khi truyền user) và hai ảnh
+        for i in range(count):
+            number = Post.objects.count()
+            author = user or User.objects.create_user(username=f'author{number}', email=f'author{number}@example.com',
+                                                      password='secret', role=1)
+            if i % 3 == 1:
+                post = SurveyPost.objects.create(content='Khảo sát', user=author, survey_type=SurveyType.INCOME.value,
+                                                 end_time=timezone.now() + timedelta(days=1))
+            elif i % 3 == 2:
+                post = InvitationPost.objects.create(content='Sự kiện', user=author, event_name='Họp lớp')
+            else:
+                post = Post.objects.create(content='Bài viết', user=author)
+            self.add_images(post, 2)
+
+    def add_images(self, post, count):
+        PostImage.objects.bulk_create([PostImage(post=post, image=f'https://example.com/{post.pk}/{i}.png')
+                                       for i in range(count)])
+
+    def get(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(context)
+
+    def assertListQueriesConstant(self, url, params=None, user=None):
+        self.create_posts(2, user)
+        response, queries = self.get(url, params)
+        self.assertEqual(len(response.json()['results']), 2)
+
+        self.create_posts(2, user)
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, params)
+        self.assertEqual(len(response.json()['results']), 4)
+
+    def test_list_by_page(self):
+        self.assertListQueriesConstant('/post/', {'page': 1})
+
+    def test_list_by_cursor(self):
+        self.client.force_authenticate(None)
+        self.assertListQueriesConstant('/post/')
+
+    def test_cursor_page_is_not_counted(self):
+        self.client.force_authenticate(None)
+        self.create_posts(2)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/post/')
+        self.assertNotIn('X-Total-Count', response)
+        self.assertFalse([query for query in context.captured_queries if 'COUNT(' in query['sql'].upper()])
+        self.assertEqual(self.client.get('/post/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        Post.objects.filter(pk=Post.objects.first().pk).update(updated_date=timezone.now())
+        self.assertEqual(self.client.get('/post/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertIn('X-Total-Count', self.client.get('/post/', {'page': 1}))
+
+    def test_my_posts(self):
+        self.assertListQueriesConstant('/post/my-posts/', {'page': 1}, user=self.user)
+
+    def test_detail(self):
+        post = Post.objects.create(content='Bài viết', user=self.user)
+        self.add_images(post, 2)
+        response, queries = self.get(f'/post/{post.pk}/')
+        self.assertEqual(len(response.json()['images']), 2)
+
+        self.add_images(post, 2)
+        Post.objects.filter(pk=post.pk).update(updated_date=timezone.now())
+        with self.assertNumQueries(queries):
+            response = self.client.get(f'/post/{post.pk}/')
+        self.assertEqual(len(response.json()['images']), 4)
+
+
+class SurveyInvitationQueryCountTests(FeedTestCase):
+    # Trang khảo sát và thư mời tốn cùng số truy vấn với N và 2N bài, dù cache bản chụp câu hỏi trống hay đã có
+    def setUp(self):
+        super().setUp()
+        self.clear_snapshots()
+        self.admin = User.objects.create_user(username='admin', password='secret', email='admin@example.com', role=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    @staticmethod
+    def clear_snapshots():
+        cache.clear()
+        snapshots.get_snapshot.cache_clear()
+
+    def create_surveys(self, count):
+        for i in range(count):
+            survey = SurveyPost.objects.create(content='Khảo sát', user=self.admin, survey_type=SurveyType.INCOME.value,
+                                               end_time=timezone.now() + timedelta(days=1))
+            survey.add_questions([{'question': f'Câu {n}', 'multi_choice': n % 2 == 1,
+                                   'options': [{'option': 'A'}, {'option': 'B'}, {'option': 'C'}]} for n in range(3)])
+            PostImage.objects.create(post=survey, image=f'https://example.com/{survey.pk}.png')
+
+    def create_invitations(self, count):
+        group = Group.objects.create(group_name=f'Nhóm {Group.objects.count()}')
+        for i in range(count):
+            invitee = User.objects.create_user(username=f'invitee{User.objects.count()}', password='secret',
+                                               email=f'invitee{User.objects.count()}@example.com', role=1)
+            group.users.add(invitee)
+            invitation = InvitationPost.objects.create(content='Sự kiện', user=self.admin, event_name='Họp lớp')
+            invitation.add_invitees([invitee.pk, self.admin.pk], [group.pk])
+            PostImage.objects.create(post=invitation, image=f'https://example.com/{invitation.pk}.png')
+
+    def count_queries(self, url, cold):
+        if cold:
+            self.clear_snapshots()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, {'page': 1})
+        self.assertEqual(response.status_code, 200)
+        return len(response.json()['results']), len(context)
+
+    def assertQueriesConstant(self, url, create):
+        create(2)
+        cold = self.count_queries(url, cold=True)
+        warm = self.count_queries(url, cold=False)
+        self.assertEqual((cold[0], warm[0]), (2, 2))
+        self.assertLessEqual(warm[1], cold[1])
+
+        create(2)
+        self.assertEqual(self.count_queries(url, cold=True), (4, cold[1]))
+        self.assertEqual(self.count_queries(url, cold=False), (4, warm[1]))
+
+    def test_surveys(self):
+        self.assertQueriesConstant('/survey/', self.create_surveys)
+
+    def test_invitations(self):
+        self.assertQueriesConstant('/invitation/', self.create_invitations)
+
+
+class ReactionGroupQueryCountTests(FeedTestCase):
+    # Danh sách reaction và nhóm tốn một số truy vấn cố định, dù trang có 2 hay 4 dòng
+    def setUp(self):
+        super().setUp()
+        self.admin = User.objects.create_user(username='admin', password='secret', email='admin@example.com', role=0)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_user(self):
+        number = User.objects.count()
+        return User.objects.create_user(username=f'user{number}', email=f'user{number}@example.com', password='secret',
+                                        role=1)
+
+    def create_reactions(self, count):
+        for i in range(count):
+            user = self.create_user()
+            post = Post.objects.create(content='Bài viết', user=user)
+            Reaction.objects.create(user=user, post=post, reaction=ReactionType.LOVE.value)
+
+    def create_groups(self, count):
+        for i in range(count):
+            group = Group.objects.create(group_name=f'Nhóm {Group.objects.count()}')
+            group.users.add(self.create_user(), self.create_user())
+
+    def assertListQueries(self, url, create, queries):
+        for count in (2, 4):
+            create(2)
+            with self.assertNumQueries(queries):
+                response = self.client.get(url)
+            self.assertEqual(len(response.json()['results']), count)
+
+    def test_reactions(self):
+        self.assertListQueries('/reaction/', self.create_reactions, 3)
+
+    def test_groups(self):
+        self.assertListQueries('/group/', self.create_groups, 3)
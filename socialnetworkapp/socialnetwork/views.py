@@ -1,23 +1,46 @@
+import hashlib
 import json
-from cloudinary.uploader import upload
-from django.db.models import Q
+import logging
+import os
+import uuid
+from functools import partial
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models import Q, Max, Count, Sum, F
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from rest_framework import viewsets, generics, status
 from rest_framework.decorators import action, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.generics import get_object_or_404
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, CursorPagination
 from rest_framework.parsers import MultiPartParser, JSONParser
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-from .tasks import send_email_async
-from .models import Alumni, Teacher, Post, Comment, PostImage, SurveyPost, SurveyQuestion, SurveyOption, SurveyDraft, \
-    UserSurveyOption, Reaction, Group, InvitationPost, User
+from . import analytics, drafts, emails, exports, search, snapshots
+from .feeds import get_timeline_ids, hydrate_posts, FEED_ERRORS
+from .media import upload_later, add_post_images, max_images, release_asset, stored_url, pick_image_size, \
+    StashUploadHandler, SIZES_SUFFIX
+
+from .tasks import export_survey_responses, fan_out_invitation
+from .models import Alumni, Teacher, Post, Comment, PostImage, SurveyPost, SurveyQuestion, SurveyDraft, \
+    UserSurveyOption, Reaction, Group, InvitationPost, User, PostType, \
+    UploadStatus, SurveySubmission
 from .perms import AdminPermission, OwnerPermission, AlumniPermission, CommentDeletePermission
 from .serializers import AlumniSerializer, TeacherSerializer, ChangePasswordSerializer, PostSerializer, \
-    CommentSerializer, SurveyPostSerializer, UserSerializer, SurveyDraftSerializer, \
-    ReactionSerializer, GroupSerializer, InvitationPostSerializer
-from .paginators import Pagination
+    CommentSerializer, CommentThreadSerializer, SurveyPostSerializer, UserSerializer, \
+    ReactionSerializer, GroupSerializer, InvitationPostSerializer, MediaField, SurveyQuestionSerializer
+from .paginators import Pagination, PostPagination
+
+logger = logging.getLogger(__name__)
 
 
 def index(request):
@@ -28,7 +51,115 @@ def index(request):
 
 # Create your views here.
 
-class UserViewSet(viewsets.ViewSet):
+def pending_status(image):
+    return (UploadStatus.PENDING if image else UploadStatus.READY).value
+
+
+def attach_images(post, images):
+    # Gọi bên trong transaction.atomic để lỗi ở bất kỳ ảnh nào không để lại bài viết dở dang
+    if len(images) > max_images():
+        raise ValidationError({"error": f"Chỉ được đăng tối đa {max_images()} ảnh."})
+    try:
+        add_post_images(post, images)
+    except OSError as e:
+        raise ValidationError({"error": f"Lỗi đăng ảnh: {str(e)}"})
+
+
+def invite(invitation_post, users, groups):
+    # Kiểm tra toàn bộ id bằng hai truy vấn và ghi quan hệ bằng bulk insert; thành viên nhóm được đọc
+    # và gửi thư ở nền sau khi commit nên thời gian request không phụ thuộc kích thước nhóm
+    try:
+        user_ids = {int(user_id) for user_id in (users if isinstance(users, list) else [users]) if user_id}
+        group_ids = {int(group_id) for group_id in (groups if isinstance(groups, list) else [groups]) if group_id}
+    except (TypeError, ValueError):
+        raise ValidationError({"error": "users và groups phải là danh sách id."})
+    if user_ids and User.objects.filter(pk__in=user_ids, is_active=True).count() != len(user_ids):
+        raise Http404("No User matches the given query.")
+    if group_ids and Group.objects.filter(pk__in=group_ids, active=True).count() != len(group_ids):
+        raise Http404("No Group matches the given query.")
+
+    invitation_post.add_invitees(user_ids, group_ids)
+    if user_ids or group_ids:
+        transaction.on_commit(lambda: fan_out_invitation.delay(invitation_post.pk))
+
+
+def parse_questions(questions_data):
+    # Kiểm tra toàn bộ câu hỏi trước khi ghi bất kỳ bản ghi nào
+    if isinstance(questions_data, str):
+        try:
+            questions_data = json.loads(questions_data)
+        except json.JSONDecodeError as e:
+            raise ValidationError({"error": f"Lỗi phân tích cú pháp JSON: {str(e)}"})
+    serializer = SurveyQuestionSerializer(data=questions_data, many=True)
+    if not serializer.is_valid():
+        raise ValidationError({"questions": serializer.errors})
+    return serializer.validated_data
+
+
+class EagerLoadingViewMixin:
+    def get_queryset(self):
+        return self.get_serializer().setup_eager_loading(super().get_queryset())
+
+
+class StashUploadMixin:
+    # Ảnh tải lên ở các view nhận multipart được ghi thẳng vào thư mục tạm của media pipeline theo từng chunk
+    # thay vì giữ trong bộ nhớ; phải gắn trước khi body được đọc
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers.insert(0, StashUploadHandler(request))
+        return super().initialize_request(request, *args, **kwargs)
+
+
+class ConditionalGetMixin:
+    # ETag/Last-Modified được tính từ một truy vấn phiên bản nhỏ, không cần serialize nội dung
+    def conditional_response(self, request, version, last_modified, render):
+        etag = quote_etag(hashlib.md5(repr((request.get_full_path(), version)).encode()).hexdigest())
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = render()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    def object_response(self, request, queryset, pk, render):
+        try:
+            version = queryset.filter(pk=pk).values_list('updated_date', flat=True).first()
+        except (TypeError, ValueError):
+            version = None
+        return self.conditional_response(request, version, version, render)
+
+    def collection_response(self, request, queryset, render, counted=False):
+        # Phân trang theo cursor chỉ lấy phiên bản của các bài trong trang (như timeline); tổng số bài
+        # (X-Total-Count) chỉ được đếm khi phân trang theo số trang hoặc nơi gọi cần (counted)
+        paginator = self.paginator
+        if not counted and isinstance(paginator, CursorPagination) \
+                and paginator.page_query_param not in request.query_params:
+            return self.page_response(request, queryset, render)
+
+        self.collection_version = queryset.order_by().aggregate(last_modified=Max('updated_date'), total=Count('id'))
+        response = self.conditional_response(
+            request, (self.collection_version['last_modified'], self.collection_version['total']),
+            self.collection_version['last_modified'], render)
+        response['X-Total-Count'] = self.collection_version['total']
+        return response
+
+    def page_response(self, request, queryset, render):
+        # Một truy vấn hẹp (page_size + 1 dòng) trên đúng vị trí cursor; render() phân trang lại với dữ liệu đầy đủ
+        paginator = type(self.paginator)()
+        ordering = [field.lstrip('-') for field in paginator.get_ordering(request, queryset, self)]
+        page = paginator.paginate_queryset(queryset.only('updated_date', *ordering), request, view=self)
+        last_modified = max((post.updated_date for post in page), default=None)
+        version = ([(post.pk, post.updated_date) for post in page], paginator.has_next, paginator.has_previous)
+        return self.conditional_response(request, version, last_modified, render)
+
+
+class UserViewSet(ConditionalGetMixin, viewsets.ViewSet):
     def get_permissions(self):
         if self.action in ["change_password", "get_current_user"]:
             return [OwnerPermission()]
@@ -45,15 +176,19 @@ class UserViewSet(viewsets.ViewSet):
         paginator = self.CustomPagination()
         paginated_queryset = paginator.paginate_queryset(queryset, request, view=self)
 
-        serializer = UserSerializer(paginated_queryset, many=True)
+        serializer = UserSerializer(paginated_queryset, many=True, context={'request': request})
         return paginator.get_paginated_response(serializer.data)
 
     @action(methods=['get'], url_path='current', detail=False)
     def get_current_user(self, request):
         user = request.user
         self.check_object_permissions(request, user)
-        serializer = UserSerializer(user)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Bảng kích thước ảnh suy ra từ avatar/cover nên không cần đưa vào phiên bản
+        version = [str(getattr(user, field)) for field in UserSerializer.Meta.fields
+                   if field != 'password' and not field.endswith(SIZES_SUFFIX)]
+        return self.conditional_response(
+            request, version, None,
+            lambda: Response(UserSerializer(user, context={'request': request}).data, status=status.HTTP_200_OK))
 
     @action(methods=['patch'], url_path='change-password', detail=False)
     def change_password(self, request):
@@ -76,24 +211,123 @@ class UserViewSet(viewsets.ViewSet):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class PostViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIView):
+class PostViewSet(StashUploadMixin, EagerLoadingViewMixin, ConditionalGetMixin, viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIView):
     queryset = Post.objects.filter(active=True)
     serializer_class = PostSerializer
+    pagination_class = PostPagination
     parser_classes = [JSONParser, MultiPartParser]
+    first_page_cache_timeout = 3600
 
     def get_permissions(self):
-        if self.action == "create":
+        if self.action in ["create", "get_my_posts", "my_posts_summary"]:
             return [IsAuthenticated()]
         elif self.action in ["update", "destroy", "lock_unlock_comments"]:
             return [OwnerPermission(), AdminPermission()]
         return super().get_permissions()
 
+    def list(self, request, *args, **kwargs):
+        # Người dùng đã đăng nhập đọc từ timeline chung trong Redis; ?page=, ?cursor=, ?fields=, ?expand= vẫn truy vấn trực tiếp CSDL
+        bypass_params = [self.paginator.page_query_param, self.paginator.cursor_query_param,
+                         PostSerializer.fields_query_param, PostSerializer.expand_query_param]
+        if not request.user.is_authenticated or any(param in request.query_params for param in bypass_params):
+            return self.collection_response(request, self.queryset, partial(super().list, request, *args, **kwargs))
+
+        try:
+            before = int(request.query_params.get('before')) if request.query_params.get('before') else None
+        except ValueError:
+            return Response({"error": "before không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+
+        page_size = self.paginator.page_size
+
+        def render():
+            next_url = None
+            if len(post_ids) == page_size:
+                next_url = replace_query_param(request.build_absolute_uri(), 'before', post_ids[-1])
+            # Bài viết trong cache chứa đủ các kích thước ảnh; ?img= được áp dụng sau khi lấy ra
+            results = pick_image_size(hydrate_posts(post_ids), request.query_params.get(MediaField.img_query_param))
+            return Response({'next': next_url, 'previous': None, 'results': results}, status=status.HTTP_200_OK)
+
+        try:
+            post_ids = get_timeline_ids(before, page_size)
+            version = self.queryset.filter(pk__in=post_ids).order_by().aggregate(last_modified=Max('updated_date'))
+            return self.conditional_response(request, (post_ids, version['last_modified']),
+                                             version['last_modified'], render)
+        except FEED_ERRORS as e:
+            # Redis không sẵn sàng thì phục vụ trang đầu bằng cursor pagination như khi bỏ qua timeline
+            logger.warning(f"Timeline unavailable, falling back to the database: {str(e)}")
+            return self.collection_response(request, self.queryset, partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.object_response(request, self.queryset, kwargs['pk'],
+                                    partial(super().retrieve, request, *args, **kwargs))
+
     @action(methods=['get'], url_path='my-posts', detail=False)
     def get_my_posts(self, request):
         self.check_permissions(request)
-        posts = Post.objects.filter(user=request.user, active=True)
-        serializer = self.get_serializer(posts, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.collection_response(request, self.queryset.filter(user=request.user),
+                                        partial(self.list_my_posts, request), counted=True)
+
+    def list_my_posts(self, request):
+        # Trang đầu được cache theo người dùng; khóa chứa phiên bản tập bài viết nên tự mất hiệu lực khi
+        # bài viết được tạo, sửa, xóa mềm hoặc thay đổi bộ đếm
+        page_number = request.query_params.get(self.paginator.page_query_param)
+        first_page = self.paginator.cursor_query_param not in request.query_params and page_number in (None, '1')
+        cache_key = None
+        if first_page:
+            version = (request.get_full_path(), self.collection_version['last_modified'],
+                       self.collection_version['total'])
+            cache_key = f"my_posts:{request.user.id}:{hashlib.md5(repr(version).encode()).hexdigest()}"
+            data = cache.get(cache_key)
+            if data is not None:
+                return Response(data, status=status.HTTP_200_OK)
+
+        posts = self.get_queryset().filter(user=request.user)
+        page = self.paginate_queryset(posts)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            response = self.get_paginated_response(serializer.data)
+        else:
+            serializer = self.get_serializer(posts, many=True)
+            response = Response(serializer.data, status=status.HTTP_200_OK)
+
+        if cache_key:
+            cache.set(cache_key, response.data, self.first_page_cache_timeout)
+        return response
+
+    @action(methods=['get'], url_path='my-posts/summary', detail=False)
+    def my_posts_summary(self, request):
+        self.check_permissions(request)
+        summary = self.queryset.filter(user=request.user).order_by().aggregate(
+            total=Count('id'),
+            posts=Count('id', filter=Q(post_type=PostType.POST.value)),
+            surveys=Count('id', filter=Q(post_type=PostType.SURVEY.value)),
+            invitations=Count('id', filter=Q(post_type=PostType.INVITATION.value)),
+            comments=Coalesce(Sum('comment_count'), 0),
+            reactions=Coalesce(Sum(F('like_count') + F('haha_count') + F('love_count')), 0),
+            last_posted=Max('created_date'),
+        )
+        return Response(summary, status=status.HTTP_200_OK)
+
+    @action(methods=['get'], url_path='search', detail=False)
+    def search_posts(self, request):
+        hits = search.search(request.query_params.get('q', ''))
+
+        posts = self.get_queryset().in_bulk([post_id for (post_id, comment_id), score in hits])
+        comments = CommentThreadSerializer().setup_eager_loading(Comment.objects.filter(active=True)).in_bulk(
+            [comment_id for (post_id, comment_id), score in hits if comment_id])
+        matches = [(posts[post_id], comments.get(comment_id), score) for (post_id, comment_id), score in hits
+                   if post_id in posts and (comment_id is None or comment_id in comments)]
+
+        paginator = Pagination()
+        page = paginator.paginate_queryset(matches, request, view=self)
+        post_data = self.get_serializer([post for post, comment, score in page], many=True).data
+        results = [{
+            'object_type': 'comment' if comment else post.object_type,
+            'score': round(score, 4),
+            'post': data,
+            'comment': CommentThreadSerializer(comment).data if comment else None,
+        } for (post, comment, score), data in zip(page, post_data)]
+        return paginator.get_paginated_response(results)
 
     @action(methods=['post'], url_path='comment', detail=True)
     def create_comment(self, request, pk=None):
@@ -106,18 +340,40 @@ class PostViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIVi
         content = request.data.get('content')
         image = request.FILES.get('image')
 
-        image_url = None
-        if image:
-            try:
-                upload_result = upload(image, folder='MangXaHoi')
-                image_url = upload_result.get('secure_url')
-            except Exception as e:
-                return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                comment = Comment.objects.create(content=content, user=request.user, post=post,
+                                                 upload_status=pending_status(image))
+                if image:
+                    upload_later(comment, 'image', image)
+        except OSError as e:
+            return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
-        comment = Comment.objects.create(content=content, image=image_url, user=request.user, post=post)
         serializer = CommentSerializer(comment)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(methods=['get'], url_path='comments', detail=True)
+    def get_comments(self, request, pk=None):
+        post = get_object_or_404(Post, pk=pk, active=True)
+        comments = CommentThreadSerializer().setup_eager_loading(Comment.objects.filter(post=post, active=True))
+
+        root_id = request.query_params.get('root')
+        max_depth = request.query_params.get('depth')
+        try:
+            if root_id:
+                root = get_object_or_404(Comment, pk=int(root_id), post=post, active=True)
+                comments = comments.filter(Q(pk=root.pk) | Q(path__startswith=root.subtree_path()))
+                base_depth = root.depth
+            else:
+                base_depth = 0
+            if max_depth:
+                comments = comments.filter(depth__lte=base_depth + int(max_depth))
+        except ValueError:
+            return Response({"error": "Tham số root/depth không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+
+        comments = comments.order_by('created_date', 'id')
+        return Response(CommentThreadSerializer.build_tree(comments, base_depth), status=status.HTTP_200_OK)
+
     @action(methods=['patch'], url_path='lock-unlock-comment', detail=True)
     def lock_unlock_comments(self, request, pk=None):
         post = get_object_or_404(Post, pk=pk, active=True)
@@ -127,7 +383,7 @@ class PostViewSet(viewsets.ViewSet, generics.RetrieveAPIView, generics.ListAPIVi
         return Response({'message': 'Cập nhật trạng thái bình luận thành công.'}, status=status.HTTP_200_OK)
 
 
-class CommentViewSet(viewsets.ViewSet):
+class CommentViewSet(StashUploadMixin, viewsets.ViewSet):
     queryset = Comment.objects.filter(active=True)
     serializer_class = CommentSerializer
     parser_classes = [JSONParser, MultiPartParser]
@@ -147,14 +403,15 @@ class CommentViewSet(viewsets.ViewSet):
         image = request.FILES.get('image')
 
         try:
-            if image:
-                upload_result = upload(image, folder='MangXaHoi')
-                comment.image = upload_result.get('secure_url')
-            else:
+            with transaction.atomic():
+                release_asset(stored_url(comment.image))
                 comment.image = None
-            comment.content = content
-            comment.save(update_fields=['content', 'image'])
-        except Exception as e:
+                comment.upload_status = pending_status(image)
+                comment.content = content
+                comment.save(update_fields=['content', 'image', 'upload_status'])
+                if image:
+                    upload_later(comment, 'image', image)
+        except OSError as e:
             return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({'message': 'Chỉnh sửa bình luận thành công.'}, status=status.HTTP_200_OK)
@@ -176,27 +433,27 @@ class CommentViewSet(viewsets.ViewSet):
         content = request.data.get('content')
         image = request.FILES.get('image')
 
-        image_url = None
-        if image:
-            try:
-                upload_result = upload(image, folder='MangXaHoi')
-                image_url = upload_result.get('secure_url')
-            except Exception as e:
-                return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
-
-        reply = Comment.objects.create(content=content, image=image_url, user=request.user, post=comment.post,
-                                       parent=comment)
+        try:
+            with transaction.atomic():
+                reply = Comment.objects.create(content=content, user=request.user, post=comment.post, parent=comment,
+                                               upload_status=pending_status(image))
+                if image:
+                    upload_later(reply, 'image', image)
+        except DjangoValidationError as e:
+            return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
+        except OSError as e:
+            return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
 
         serializer = CommentSerializer(reply)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class ReactionViewSet(viewsets.ViewSet, generics.ListAPIView):
+class ReactionViewSet(EagerLoadingViewMixin, viewsets.ViewSet, generics.ListAPIView):
     queryset = Reaction.objects.filter(active=True)
     serializer_class = ReactionSerializer
 
 
-class AlumniViewSet(viewsets.ViewSet, generics.CreateAPIView):
+class AlumniViewSet(StashUploadMixin, viewsets.ViewSet, generics.CreateAPIView):
     queryset = Alumni.objects.select_related('user')
     serializer_class = AlumniSerializer
     pagination_class = Pagination
@@ -222,26 +479,29 @@ class AlumniViewSet(viewsets.ViewSet, generics.CreateAPIView):
     @action(methods=['post'], url_path='approve', detail=False, permission_classes=[AdminPermission])
     def approve_alumni_bulk(self, request):
         pks = request.data.get('pks', [])
-        alumni_list = Alumni.objects.filter(pk__in=pks, is_verified=False)
+        alumni_list = Alumni.objects.filter(pk__in=pks, is_verified=False).select_related('user')
 
+        recipients = []
         for alumni in alumni_list:
             alumni.is_verified = True
             alumni.user.is_active = True
             alumni.save(update_fields=['is_verified'])
             alumni.user.save(update_fields=['is_active'])
+            recipients.append((alumni.user.email, {'first_name': alumni.user.first_name}))
 
-            send_email_async.delay(
-                subject='Thông báo duyệt tài khoản',
-                message=f"""
-                    Chào {alumni.user.first_name},
+        # Gửi theo lô, mỗi lô dùng chung một phiên SMTP
+        emails.queue_emails(
+            subject='Thông báo duyệt tài khoản',
+            message="""
+                    Chào $first_name,
 
                     Tài khoản cựu sinh viên của bạn đã được duyệt.
 
                     Trân trọng,
                     Đội ngũ Admin
                 """,
-                recipient_email=alumni.user.email,
-            )
+            recipients=recipients,
+        )
 
         return Response({"message": "Duyệt tài khoản thành công.", "alumni_ids": pks}, status=status.HTTP_200_OK)
 
@@ -257,7 +517,7 @@ class AlumniViewSet(viewsets.ViewSet, generics.CreateAPIView):
         return Response({"message": "Đã từ chối các tài khoản.", "alumni_ids": pks}, status=status.HTTP_200_OK)
 
 
-class TeacherViewSet(viewsets.ViewSet, generics.CreateAPIView):
+class TeacherViewSet(StashUploadMixin, viewsets.ViewSet, generics.CreateAPIView):
     queryset = Teacher.objects.select_related('user')
     serializer_class = TeacherSerializer
     pagination_class = Pagination
@@ -287,31 +547,36 @@ class TeacherViewSet(viewsets.ViewSet, generics.CreateAPIView):
     @action(methods=['post'], url_path='reset', detail=False)
     def reset_password_time_bulk(self, request):
         pks = request.data.get('pks', [])
-        teachers = Teacher.objects.filter(pk__in=pks)
+        teachers = Teacher.objects.filter(pk__in=pks).select_related('user')
 
+        recipients = []
         for teacher in teachers:
             if teacher.must_change_password and teacher.is_password_change_expired():
                 teacher.unlock_account()
-                # Gửi email thông báo
-                send_email_async.delay(
-                    subject='Thông báo gia hạn thời gian đổi mật khẩu',
-                    message=f"""
-                        Chào {teacher.user.first_name},
+                recipients.append((teacher.user.email, {'first_name': teacher.user.first_name}))
+
+        # Gửi email thông báo theo lô
+        emails.queue_emails(
+            subject='Thông báo gia hạn thời gian đổi mật khẩu',
+            message="""
+                        Chào $first_name,
 
                         Tài khoản giảng viên của bạn đã được gia hạn thời gian đổi mật khẩu.
 
                         Trân trọng,
                         Đội ngũ Admin
                     """,
-                    recipient_email=teacher.user.email,
-                )
+            recipients=recipients,
+        )
 
         return Response({"message": "Đã đặt lại thời gian cho các giáo viên được chọn."}, status=status.HTTP_200_OK)
 
 
-class SurveyPostViewSet(viewsets.ViewSet):
+class SurveyPostViewSet(StashUploadMixin, EagerLoadingViewMixin, ConditionalGetMixin, viewsets.ViewSet, generics.ListAPIView,
+                        generics.RetrieveAPIView):
     queryset = SurveyPost.objects.filter(active=True)
     serializer_class = SurveyPostSerializer
+    pagination_class = PostPagination
     parser_classes = [JSONParser, MultiPartParser]
 
     def get_permissions(self):
@@ -321,44 +586,38 @@ class SurveyPostViewSet(viewsets.ViewSet):
             return [OwnerPermission()]
         elif self.action in ["draft", "submit_survey"]:
             return [AlumniPermission()]
+        elif self.action in ["survey_results", "export_responses", "survey_analytics"]:
+            return [AdminPermission()]
         elif self.action == "resume_survey":
             return [OwnerPermission()]
         return super().get_permissions()
 
+    def list(self, request, *args, **kwargs):
+        return self.collection_response(request, self.queryset, partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.object_response(request, self.queryset, kwargs['pk'],
+                                    partial(super().retrieve, request, *args, **kwargs))
+
+    @transaction.atomic
     def create(self, request):
         self.check_permissions(request)
         content = request.data.get('content')
         images = request.FILES.getlist('images')
         survey_type = request.data.get('survey_type')
         end_time = request.data.get('end_time')
-        questions_data = request.data.get('questions')
-
-        try:
-            questions_data = json.loads(questions_data)
-        except json.JSONDecodeError as e:
-            return Response({"error": f"Lỗi phân tích cú pháp JSON: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        questions = parse_questions(request.data.get('questions', []))
 
         survey_post = SurveyPost.objects.create(content=content, user=request.user, survey_type=survey_type,
                                                 end_time=end_time)
 
-        for image in images:
-            try:
-                upload_result = upload(image, folder='MangXaHoi')
-                image_url = upload_result.get('secure_url')
-                PostImage.objects.create(post=survey_post, image=image_url)
-            except Exception as e:
-                return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        attach_images(survey_post, images)
+        survey_post.add_questions(questions)
 
         serializer = self.get_serializer(survey_post)
-
-        for question_data in questions_data:
-            options_data = question_data.pop('options', [])
-            question = SurveyQuestion.objects.create(survey_post=survey_post, **question_data)
-            for option_data in options_data:
-                SurveyOption.objects.create(survey_question=question, **option_data)
-
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def update(self, request, pk=None):
         survey_post = get_object_or_404(SurveyPost, pk=pk, active=True)
         self.check_object_permissions(request, survey_post)
@@ -367,13 +626,12 @@ class SurveyPostViewSet(viewsets.ViewSet):
         images = request.FILES.getlist('images')
         survey_type = request.data.get('survey_type', survey_post.survey_type)
         end_time = request.data.get('end_time', survey_post.end_time)
-        questions_data = request.data.get('questions', [])
-
-        if isinstance(questions_data, str):
-            questions_data = json.loads(questions_data)
-
-        if not isinstance(questions_data, list):
-            questions_data = []
+        questions = None
+        if 'questions' in request.data:
+            questions = parse_questions(request.data['questions'])
+            if SurveySubmission.objects.filter(survey_post=survey_post).exists():
+                return Response({"error": "Không thể sửa câu hỏi của khảo sát đã có người trả lời."},
+                                status=status.HTTP_400_BAD_REQUEST)
 
         survey_post.content = content
         survey_post.survey_type = survey_type
@@ -381,108 +639,151 @@ class SurveyPostViewSet(viewsets.ViewSet):
         survey_post.save()
 
         PostImage.objects.filter(post=survey_post).delete()
-        if images:
-            for image in images:
-                try:
-                    upload_result = upload(image, folder='MangXaHoi')
-                    image_url = upload_result.get('secure_url')
-                    PostImage.objects.create(post=survey_post, image=image_url)
-                except Exception as e:
-                    return Response({"error": f"Lỗi đăng ảnh: {str(e)}"}, status=status.HTTP_400_BAD_REQUEST)
+        attach_images(survey_post, images)
+
+        if questions is not None:
+            # Câu hỏi gửi lên thay thế toàn bộ câu hỏi cũ (cùng lựa chọn và bản nháp trỏ tới chúng)
+            SurveyQuestion.objects.filter(survey_post=survey_post).delete()
+            SurveyDraft.objects.filter(survey_post=survey_post).delete()
+            survey_post.add_questions(questions)
 
         serializer = SurveyPostSerializer(survey_post)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     @action(detail=True, url_path='draft', methods=['post'])
     def draft(self, request, pk=None):
+        # Tự động lưu chỉ tốn một truy vấn exists() theo khóa duy nhất của SurveySubmission (hạn khảo sát được
+        # cache): câu trả lời được gộp theo từng câu hỏi trong bộ đệm và flush_survey_drafts ghi xuống SurveyDraft
+        # (bỏ qua khảo sát đã đóng hoặc đã nộp)
         self.check_permissions(request)
-        existing_answers = UserSurveyOption.objects.filter(
-            user=request.user, survey_option__survey_question__survey_post=pk
-        )
-        if existing_answers.exists():
+        try:
+            survey_id = int(pk)
+        except (TypeError, ValueError):
+            return Response({"error": "Survey not found."}, status=status.HTTP_404_NOT_FOUND)
+
+        end_time = snapshots.get_end_time(survey_id)
+        if end_time is None:
+            return Response({"error": "Survey not found."}, status=status.HTTP_404_NOT_FOUND)
+        if end_time <= timezone.now():
+            return Response({"error": "This survey has ended."}, status=status.HTTP_400_BAD_REQUEST)
+        if SurveySubmission.objects.filter(survey_post_id=survey_id, user=request.user).exists():
             return Response({"error": "You had completed this survey."}, status=status.HTTP_400_BAD_REQUEST)
 
-        data = request.data
-        survey_post = get_object_or_404(SurveyPost, pk=pk, active=True)
-        answers = data.get('answers', {})
-
-        formatted_answers = [{'question_id': key, 'selected_options': value} for key, value in answers.items()]
-
-        draft_instance = SurveyDraft.objects.filter(survey_post=survey_post, user=request.user).first()
-
-        if draft_instance:
-            draft_instance.answers = formatted_answers
-            draft_instance.save(update_fields=['answers'])
-            serializer = SurveyDraftSerializer(draft_instance)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+        answers = request.data.get('answers', {})
+        if not isinstance(answers, dict) or not all(isinstance(value, list) for value in answers.values()):
+            return Response({"error": "Answers must be an object of question id to option ids."},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        draft_data = {
-            'survey_post': survey_post.id,
-            'user': request.user.id,
-            'answers': formatted_answers
-        }
+        buffered = drafts.save(survey_id, request.user.id, {str(key): value for key, value in answers.items()})
+        return Response({'survey_post': survey_id, 'user': request.user.id, 'answers': buffered},
+                        status=status.HTTP_200_OK)
 
-        serializer = SurveyDraftSerializer(data=draft_data)
+    @action(detail=True, url_path='resume', methods=['get'])
+    def resume_survey(self, request, pk=None):
+        try:
+            survey_id = int(pk)
+        except (TypeError, ValueError):
+            return Response({"error": "Survey not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        draft = SurveyDraft.objects.filter(survey_post_id=survey_id, user=request.user).first()
 
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        has_completed = SurveySubmission.objects.filter(survey_post_id=survey_id, user=request.user).exists()
 
-    @action(detail=True, url_path='resume', methods=['get'])
-    def resume_survey(self, request, pk=None):
-        draft = SurveyDraft.objects.filter(survey_post_id=pk, user=request.user).first()
+        if draft:
+            self.check_object_permissions(request, draft)
 
-        has_completed = UserSurveyOption.objects.filter(user=request.user,
-                                                        survey_option__survey_question__survey_post=pk).exists()
+        answers = None if has_completed else drafts.load(survey_id, request.user.id, draft)
+        return Response({"answers": answers, "has_completed": has_completed}, status=status.HTTP_200_OK)
 
-        if not draft:
-            return Response({"answers": None, "has_completed": has_completed}, status=status.HTTP_200_OK)
+    @action(detail=True, url_path='results', methods=['get'])
+    def survey_results(self, request, pk=None):
+        # Khảo sát hết hạn bị đóng (active=False) nhưng kết quả vẫn xem được cho đến khi bị xóa
+        survey_post = get_object_or_404(SurveyPost, pk=pk, deleted_date__isnull=True)
+        return Response({'id': survey_post.id, 'questions': survey_post.results()}, status=status.HTTP_200_OK)
 
-        self.check_object_permissions(request, draft)
+    @action(detail=False, url_path='analytics', methods=['get'])
+    def survey_analytics(self, request):
+        # ?surveys=1,2[&rows=<question_id>&columns=<question_id>] để kèm bảng chéo của hai câu hỏi
+        try:
+            survey_ids = {int(pk) for pk in request.query_params.get('surveys', '').split(',') if pk.strip()}
+            rows = request.query_params.get('rows')
+            columns = request.query_params.get('columns')
+            rows, columns = (int(rows), int(columns)) if rows and columns else (None, None)
+        except ValueError:
+            return Response({"error": "Tham số không hợp lệ."}, status=status.HTTP_400_BAD_REQUEST)
+        if not survey_ids:
+            return Response({"error": "Yêu cầu danh sách khảo sát (surveys)."}, status=status.HTTP_400_BAD_REQUEST)
+        if SurveyPost.objects.filter(pk__in=survey_ids, deleted_date__isnull=True).count() != len(survey_ids):
+            return Response({"error": "Survey not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        return Response({"answers": draft.answers, "has_completed": has_completed}, status=status.HTTP_200_OK)
+        try:
+            data = analytics.get_analytics(survey_ids)
+            if rows is not None:
+                data = {**data, 'crosstab': analytics.crosstab(data, rows, columns)}
+        except ImproperlyConfigured as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return Response(data, status=status.HTTP_200_OK)
+
+    @action(detail=True, url_path='export', methods=['get', 'post'])
+    def export_responses(self, request, pk=None):
+        # GET ?type=csv|ndjson: stream trực tiếp; POST {type}: xuất file bằng Celery, tải lại bằng GET ?file=
+        survey_post = get_object_or_404(SurveyPost, pk=pk, deleted_date__isnull=True)
+
+        file_name = request.query_params.get('file')
+        if request.method == 'GET' and file_name:
+            path = exports.export_path(file_name)
+            if exports.parse_export_file_name(file_name) != survey_post.id or not os.path.exists(path):
+                return Response({"error": "Export file not found or not ready yet."}, status=status.HTTP_404_NOT_FOUND)
+            return FileResponse(open(path, 'rb'), as_attachment=True, filename=file_name,
+                                content_type=exports.FORMATS[os.path.splitext(file_name)[1][1:]])
+
+        params = request.data if request.method == 'POST' else request.query_params
+        export_format = params.get('type', 'csv')
+        if export_format not in exports.FORMATS:
+            return Response({"error": f"Định dạng không hợp lệ. Chọn một trong: {', '.join(exports.FORMATS)}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if request.method == 'POST':
+            file_name = exports.export_file_name(survey_post.id, uuid.uuid4().hex, export_format)
+            export_survey_responses.delay(survey_post.id, export_format, file_name)
+            return Response({"file": file_name}, status=status.HTTP_202_ACCEPTED)
+
+        response = StreamingHttpResponse(exports.iter_export(survey_post, export_format),
+                                         content_type=exports.FORMATS[export_format])
+        response['Content-Disposition'] = f'attachment; filename="survey_{survey_post.id}.{export_format}"'
+        return response
 
     @action(detail=True, url_path='submit', methods=['post'])
     def submit_survey(self, request, pk=None):
         self.check_permissions(request)
-        data = request.data
-        user = request.user
         survey_post = get_object_or_404(SurveyPost, pk=pk, active=True)
-        answers = data.get('answers', {})
-
-        existing_answers = UserSurveyOption.objects.filter(user=user, survey_option__survey_question__survey_post=pk)
-        if existing_answers.exists():
-            return Response({"error": "You had completed this survey."}, status=status.HTTP_400_BAD_REQUEST)
-
-        required_question_ids = set(survey_post.questions.values_list('id', flat=True))
-        answered_question_ids = set(int(question_id) for question_id in answers.keys())
-
-        if required_question_ids - answered_question_ids:
-            return Response({"error": "You must answer all questions."}, status=status.HTTP_400_BAD_REQUEST)
 
-        for question_id, selected_option_ids in answers.items():
-            for option_id in selected_option_ids:
-                UserSurveyOption.objects.create(user=user, survey_option_id=option_id)
-
-        SurveyDraft.objects.filter(user=user, survey_post=survey_post).delete()
+        try:
+            survey_post.submit(request.user, request.data.get('answers', {}))
+        except DjangoValidationError as e:
+            return Response({"error": e.messages[0]}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({"message": "Survey submitted successfully."}, status=status.HTTP_201_CREATED)
 
 
-class GroupViewSet(viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView,
+class GroupViewSet(EagerLoadingViewMixin, viewsets.ViewSet, generics.ListAPIView, generics.CreateAPIView,
                    generics.RetrieveAPIView, generics.DestroyAPIView, generics.UpdateAPIView):
     queryset = Group.objects.filter(active=True)
     serializer_class = GroupSerializer
     permission_classes = [AdminPermission]
 
 
-class InvitationPostViewSet(viewsets.ViewSet, generics.ListAPIView, generics.RetrieveAPIView):
+class InvitationPostViewSet(StashUploadMixin, EagerLoadingViewMixin, ConditionalGetMixin, viewsets.ViewSet, generics.ListAPIView,
+                            generics.RetrieveAPIView):
     queryset = InvitationPost.objects.all()
     serializer_class = InvitationPostSerializer
+    pagination_class = PostPagination
     permission_classes = [AdminPermission]
 
+    def list(self, request, *args, **kwargs):
+        return self.collection_response(request, self.queryset, partial(super().list, request, *args, **kwargs))
+
+    @transaction.atomic
     def create(self, request):
 
         event_name = request.data.get('event_name')
@@ -499,51 +800,15 @@ class InvitationPostViewSet(viewsets.ViewSet, generics.ListAPIView, generics.Ret
 
         invitation_post = InvitationPost.objects.create(content=content, user=request.user, event_name=event_name)
 
-        if images:
-            for image in images:
-                upload_result = upload(image, folder='MangXaHoi')
-                image_url = upload_result.get('secure_url')
-                PostImage.objects.create(post=invitation_post, image=image_url)
-
-        if users:
-            for user_id in users:
-                user = get_object_or_404(User, id=user_id, is_active=True)
-                invitation_post.users.add(user)
-                send_email_async.delay(
-                    subject=f"Lời mời tham gia sự kiện: {invitation_post.event_name}",
-                    message=f"""Xin chào,
-
-                                Bạn được mời tham gia sự kiện '{invitation_post.event_name}' trên nền tảng của chúng tôi.
-                                Nội dung sự kiện: {invitation_post.content}
-
-                                Trân trọng,
-                                Đội ngũ Admin.
-                            """,
-                    recipient_email=user.email
-                )
-
-        if groups:
-            for group_id in groups:
-                group = get_object_or_404(Group, id=group_id, active=True)
-                invitation_post.groups.add(group)
-                for user in group.users.filter(is_active=True):
-                    send_email_async.delay(
-                        subject=f"Lời mời tham gia sự kiện: {invitation_post.event_name}",
-                        message=f"""Xin chào,
-
-                                    Bạn được mời tham gia sự kiện '{invitation_post.event_name}' trên nền tảng của chúng tôi.
-                                    Nội dung sự kiện: {invitation_post.content}
-
-                                    Trân trọng,
-                                    Đội ngũ Admin.
-                                """,
-                        recipient_email=user.email
-                    )
+        attach_images(invitation_post, images)
+
+        invite(invitation_post, users, groups)
 
         serializer = InvitationPostSerializer(invitation_post)
 
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @transaction.atomic
     def update(self, request, pk=None):
         invitation_post = get_object_or_404(InvitationPost, pk=pk, user=request.user, active=True)
 
@@ -563,50 +828,14 @@ class InvitationPostViewSet(viewsets.ViewSet, generics.ListAPIView, generics.Ret
 
         invitation_post.images.all().delete()
         if images:
-            for image in images:
-                upload_result = upload(image, folder='MangXaHoi')
-                image_url = upload_result.get('secure_url')
-                PostImage.objects.create(post=invitation_post, image=image_url)
+            attach_images(invitation_post, images)
             invitation_post.save()
 
         invitation_post.users.clear()
-        if users:
-            for user_id in users:
-                user = get_object_or_404(User, id=user_id, is_active=True)
-                invitation_post.users.add(user)
-                send_email_async.delay(
-                    subject=f"Lời mời tham gia sự kiện: {invitation_post.event_name}",
-                    message=f"""Xin chào,
-
-                                Bạn được mời tham gia sự kiện '{invitation_post.event_name}' trên nền tảng của chúng tôi.
-                                Nội dung sự kiện: {invitation_post.content}
-
-                                Trân trọng,
-                                Đội ngũ Admin.
-                            """,
-                    recipient_email=user.email
-                )
-            invitation_post.save()
-
         invitation_post.groups.clear()
-        if groups:
-            for group_id in groups:
-                group = get_object_or_404(Group, id=group_id, active=True)
-                invitation_post.groups.add(group)
-                for user in group.users.filter(is_active=True):
-                    send_email_async.delay(
-                        subject=f"Lời mời tham gia sự kiện: {invitation_post.event_name}",
-                        message=f"""Xin chào,
-
-                                    Bạn được mời tham gia sự kiện '{invitation_post.event_name}' trên nền tảng của chúng tôi.
-                                    Nội dung sự kiện: {invitation_post.content}
-    
-                                    Trân trọng,
-                                    Đội ngũ Admin.
-                                """,
-                        recipient_email=user.email
-                    )
-            invitation_post.save()
+        invite(invitation_post, users, groups)
+        # Danh sách người được mời là một phần nội dung bài viết (ETag)
+        invitation_post.save(update_fields=['updated_date'])
 
         serializer = InvitationPostSerializer(invitation_post)
         return Response(serializer.data, status=status.HTTP_200_OK)
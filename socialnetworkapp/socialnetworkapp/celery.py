@@ -31,6 +31,10 @@ celery_app.conf.beat_schedule = {
             'task': 'socialnetwork.tasks.deactivate_expired_surveys',
             'schedule': crontab(minute=0),
         },
+    'flush-survey-drafts-every-30-seconds': {
+        'task': 'socialnetwork.tasks.flush_survey_drafts',
+        'schedule': 30,
+    },
 }
 
 celery_app.conf.broker_connection_retry_on_startup = True
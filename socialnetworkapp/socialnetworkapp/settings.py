@@ -96,6 +96,8 @@ EMAIL_USE_TLS = True
 EMAIL_HOST_USER = os.getenv('EMAIL_SEND')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('EMAIL_SEND')
+# Số thư gửi chung một phiên SMTP trong mỗi task send_email_batch
+EMAIL_BATCH_SIZE = 100
 
 TEMPLATES = [
     {
@@ -126,6 +128,28 @@ CHANNEL_LAYERS = {
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/2',
+    }
+}
+
+FEED = {
+    'BACKEND': 'socialnetwork.feeds.RedisFeedBackend',
+    'LOCATION': 'redis://127.0.0.1:6379/1',
+    'MAX_LENGTH': 500,
+    'POST_TIMEOUT': TIME,
+}
+
+# Bản nháp khảo sát được gom trong Redis và ghi xuống SurveyDraft theo lô bởi flush_survey_drafts
+SURVEY_DRAFTS = {
+    'BACKEND': 'socialnetwork.drafts.RedisDraftBackend',
+    'LOCATION': 'redis://127.0.0.1:6379/1',
+    'BATCH_SIZE': 500,
+    'TIMEOUT': 7 * 24 * 60 * 60,
+}
+
 
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -185,6 +209,22 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+MEDIA_URL = '/media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
+# Ảnh tải lên được ghi vào TEMP_DIR rồi được Celery đăng lên BACKEND
+# (dùng socialnetwork.media.LocalMediaBackend để lưu vào MEDIA_ROOT khi không có Cloudinary)
+MEDIA_PIPELINE = {
+    'BACKEND': 'socialnetwork.media.CloudinaryMediaBackend',
+    'TEMP_DIR': BASE_DIR / 'tmp_uploads',
+    # Chiều rộng tối đa của các kích thước ảnh trả về qua API (?img=thumb|feed|full)
+    'IMAGE_SIZES': {'thumb': 150, 'feed': 720, 'full': None},
+    'MAX_UPLOAD_SIZE': 10 * 1024 * 1024,
+}
+
+# File xuất câu trả lời khảo sát do Celery ghi, chỉ tải về qua API (không công khai như MEDIA_ROOT)
+SURVEY_EXPORT_ROOT = BASE_DIR / 'exports'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 